@@ -10,7 +10,6 @@ from fastapi.responses import JSONResponse
 
 import structlog
 
-from app.core.config import get_settings
 from app.models.schemas import (
     TNVEDSearchRequest,
     TNVEDSearchResponse,
@@ -21,27 +20,13 @@ from app.models.schemas import (
     ErrorResponse,
     SuccessResponse
 )
-from app.services.rls_tnved_info import TNVEDInfoService
+from app.services.rls_tnved_info import TNVEDInfoService, get_tnved_info_service
 
 logger = structlog.get_logger(__name__)
 
 router = APIRouter()
 
 
-def get_tnved_info_service() -> Optional[TNVEDInfoService]:
-    """Получение сервиса TNVED Info"""
-    settings = get_settings()
-    
-    if not settings.TNVED_INFO_USERNAME or not settings.TNVED_INFO_PASSWORD:
-        logger.warning("TNVED Info credentials not configured")
-        return None
-    
-    return TNVEDInfoService(
-        username=settings.TNVED_INFO_USERNAME,
-        password=settings.TNVED_INFO_PASSWORD
-    )
-
-
 @router.post("/search", response_model=TNVEDSearchResponse)
 async def search_tnved_codes(
     request: TNVEDSearchRequest,
@@ -2,21 +2,54 @@
 Telegram Bot Webhook endpoints
 """
 
+import hmac
 import json
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
-from fastapi import APIRouter, Request, HTTPException, Depends
+from fastapi import APIRouter, Request, HTTPException, Depends, Header
 from fastapi.responses import JSONResponse
 
-from app.services.rls_telegram_bot import TelegramBotService
+from app.services.rls_telegram_bot import get_telegram_bot_service
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Путь webhook относительно публичного адреса API (WEBHOOK_URL)
+WEBHOOK_PATH = "/api/v1/telegram/webhook"
 
-@router.post("/webhook")
+
+def verify_webhook_secret(
+    x_telegram_bot_api_secret_token: Optional[str] = Header(default=None)
+) -> None:
+    """
+    Проверка секрета webhook (settings.WEBHOOK_SECRET)
+    
+    Telegram передаёт его в заголовке X-Telegram-Bot-Api-Secret-Token;
+    без настроенного секрета запросы отклоняются.
+    """
+    secret = settings.WEBHOOK_SECRET
+    if not secret or not x_telegram_bot_api_secret_token or not hmac.compare_digest(
+        x_telegram_bot_api_secret_token, secret
+    ):
+        raise HTTPException(status_code=403, detail="Invalid webhook secret token")
+
+
+async def setup_webhook() -> None:
+    """Установка webhook при запуске приложения (адрес и секрет из настроек)"""
+    if not settings.WEBHOOK_URL or not settings.WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_URL or WEBHOOK_SECRET not configured, Telegram webhook not set")
+        return
+    
+    bot = await get_telegram_bot_service()
+    await bot.set_webhook(
+        f"{settings.WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=settings.WEBHOOK_SECRET
+    )
+
+
+@router.post("/webhook", dependencies=[Depends(verify_webhook_secret)])
 async def telegram_webhook(request: Request):
     """Webhook endpoint для Telegram Bot API"""
     try:
@@ -34,12 +67,9 @@ async def telegram_webhook(request: Request):
         if "text" not in message:
             return JSONResponse(content={"status": "ok"})
         
-        # Инициализируем бота
-        async with TelegramBotService(settings.TELEGRAM_BOT_TOKEN) as bot:
-            await bot.initialize()
-            
-            # Обрабатываем сообщение
-            await bot.process_message(message)
+        # Обрабатываем сообщение общим экземпляром бота
+        bot = await get_telegram_bot_service()
+        await bot.process_message(message)
         
         return JSONResponse(content={"status": "ok"})
         
@@ -48,54 +78,17 @@ async def telegram_webhook(request: Request):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/webhook")
-async def set_webhook():
-    """Установка webhook для Telegram бота"""
-    try:
-        import aiohttp
-        
-        # URL для webhook (замените на ваш домен)
-        webhook_url = "https://your-domain.com/api/v1/telegram/webhook"
-        
-        # Устанавливаем webhook
-        url = f"https://api.telegram.org/bot{settings.TELEGRAM_BOT_TOKEN}/setWebhook"
-        data = {"url": webhook_url}
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=data) as response:
-                result = await response.json()
-                
-                if result.get("ok"):
-                    logger.info(f"Webhook set successfully: {webhook_url}")
-                    return {"status": "success", "webhook_url": webhook_url}
-                else:
-                    logger.error(f"Failed to set webhook: {result}")
-                    return {"status": "error", "description": result.get("description")}
-                    
-    except Exception as e:
-        logger.error(f"Error setting webhook: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@router.delete("/webhook")
+@router.delete("/webhook", dependencies=[Depends(verify_webhook_secret)])
 async def delete_webhook():
-    """Удаление webhook для Telegram бота"""
+    """Удаление webhook для Telegram бота (требует секрет webhook в заголовке)"""
     try:
-        import aiohttp
-        
-        # Удаляем webhook
-        url = f"https://api.telegram.org/bot{settings.TELEGRAM_BOT_TOKEN}/deleteWebhook"
+        bot = await get_telegram_bot_service()
+        result = await bot.delete_webhook()
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url) as response:
-                result = await response.json()
-                
-                if result.get("ok"):
-                    logger.info("Webhook deleted successfully")
-                    return {"status": "success", "message": "Webhook deleted"}
-                else:
-                    logger.error(f"Failed to delete webhook: {result}")
-                    return {"status": "error", "description": result.get("description")}
+        if result.get("ok"):
+            return {"status": "success", "message": "Webhook deleted"}
+        else:
+            return {"status": "error", "description": result.get("description")}
                     
     except Exception as e:
         logger.error(f"Error deleting webhook: {e}")
@@ -139,15 +132,13 @@ async def get_bot_info():
 async def send_message(chat_id: int, text: str):
     """Отправка сообщения через бота"""
     try:
-        async with TelegramBotService(settings.TELEGRAM_BOT_TOKEN) as bot:
-            await bot.initialize()
-            
-            success = await bot.send_message(chat_id, text)
-            
-            if success:
-                return {"status": "success", "message": "Message sent"}
-            else:
-                return {"status": "error", "message": "Failed to send message"}
+        bot = await get_telegram_bot_service()
+        success = await bot.send_message(chat_id, text)
+        
+        if success:
+            return {"status": "success", "message": "Message sent"}
+        else:
+            return {"status": "error", "message": "Failed to send message"}
                 
     except Exception as e:
         logger.error(f"Error sending message: {e}")
@@ -6,10 +6,16 @@ import logging
 import sys
 from typing import Any, Dict
 
+import orjson
 import structlog
 from structlog.stdlib import LoggerFactory
 
 
+def _orjson_dumps(obj: Any, **kwargs: Any) -> str:
+    """Сериализатор для JSONRenderer на базе orjson"""
+    return orjson.dumps(obj, default=kwargs.get("default")).decode()
+
+
 def setup_logging(
     log_level: str = "INFO",
     log_format: str = "json",
@@ -47,7 +53,7 @@ def setup_logging(
     ]
     
     if log_format == "json":
-        processors.append(structlog.processors.JSONRenderer())
+        processors.append(structlog.processors.JSONRenderer(serializer=_orjson_dumps))
     else:
         processors.append(structlog.dev.ConsoleRenderer())
     
@@ -0,0 +1,30 @@
+"""
+Задержки повторных запросов к внешним API
+"""
+
+import random
+from typing import Optional
+
+# Верхняя граница задержки, в том числе для заголовка Retry-After (секунды)
+MAX_RETRY_DELAY = 30.0
+
+
+def retry_delay(
+    attempt: int,
+    retry_after: Optional[str] = None,
+    base: float = 0.2,
+    max_delay: float = MAX_RETRY_DELAY
+) -> float:
+    """
+    Задержка перед повтором номер attempt (с нуля)
+    
+    Retry-After сервера, если он есть, иначе экспоненциальная задержка
+    base * 2**attempt со случайным разбросом ±50%. Результат не больше
+    max_delay: Retry-After: 3600 не задерживает запрос на час.
+    """
+    if retry_after:
+        try:
+            return min(max_delay, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+    return min(max_delay, base * 2 ** attempt * (0.5 + random.random()))
@@ -0,0 +1,40 @@
+"""
+Объединение одновременных одинаковых запросов (single-flight)
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Объединение одновременных вызовов с одинаковым ключом
+    
+    Пока запрос с ключом выполняется, остальные вызовы ждут его результат
+    вместо повторного обращения к API. Исключение запроса получают все
+    ожидающие. Отмена одного из ожидающих не отменяет общий запрос.
+    """
+    
+    def __init__(self):
+        self._inflight: Dict[Hashable, "asyncio.Future"] = {}
+    
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        """Выполнение factory() или ожидание уже идущего запроса с тем же ключом"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        
+        # shield: отмена одного из ожидающих не отменяет общий запрос
+        return await asyncio.shield(task)
+    
+    def _forget(self, key: Hashable, task: "asyncio.Future") -> None:
+        """Удаление завершённого запроса из списка выполняющихся"""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+    
+    def __len__(self) -> int:
+        return len(self._inflight)
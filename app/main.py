@@ -15,9 +15,15 @@ import structlog
 from app.core.config import settings
 from app.core.logging import setup_logging
 from app.api.v1.api import api_router
+from app.api.v1.endpoints.telegram import setup_webhook
 from app.services.airtable import AirtableService
 from app.services.tnved import TNVEDService
 from app.services.calculation import CalculationService
+from app.services.rls_openai_service import close_openai_service
+from app.services.rls_qichacha_service import close_qichacha_service
+from app.services.rls_telegram_bot import close_telegram_bot_service
+from app.services.rls_tnved_info import close_tnved_info_service
+from app.services.tnved_base import close_tnved_client
 
 # Настройка логирования
 setup_logging()
@@ -64,10 +70,23 @@ async def lifespan(app: FastAPI):
         logger.error(f"Failed to initialize services: {e}")
         raise
     
+    # Webhook Telegram бота: адрес и секрет только из настроек, не из запроса
+    try:
+        await setup_webhook()
+    except Exception as e:
+        logger.error(f"Failed to set Telegram webhook: {e}")
+    
     yield
     
     # Очистка при завершении
     logger.info("Shutting down AI Logistics Hub application")
+    await close_openai_service()
+    await close_qichacha_service()
+    await close_telegram_bot_service()
+    await close_tnved_info_service()
+    if tnved_service:
+        await tnved_service.close()
+    await close_tnved_client()
 
 
 # Создание FastAPI приложения
@@ -157,5 +176,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
+        # uvloop, если установлен (под Windows его нет - стандартный asyncio)
+        loop="auto",
         log_level="info"
     )
@@ -65,6 +65,16 @@ class CalculationRequest(BaseModel):
         }
 
 
+class BotCalculationInput(BaseModel):
+    """Данные для расчета, введенные пользователем в Telegram боте"""
+    
+    weight: float = Field(..., gt=0, description="Вес груза в кг")
+    volume: float = Field(..., gt=0, description="Объём груза в м³")
+    origin: str = Field(..., min_length=1, max_length=100, description="Город отправления")
+    destination: str = Field(..., min_length=1, max_length=100, description="Город назначения")
+    description: str = Field(..., min_length=1, max_length=500, description="Описание товара")
+
+
 class TNVEDRequest(BaseModel):
     """Схема запроса на определение ТН ВЭД"""
     
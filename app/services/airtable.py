@@ -7,6 +7,7 @@ import asyncio
 from datetime import datetime
 from typing import List, Optional, Dict, Any
 from decimal import Decimal
+from urllib.parse import urlencode
 
 import aiohttp
 import structlog
@@ -286,22 +287,33 @@ class AirtableService:
         self, 
         user_id: str, 
         limit: int = 20, 
-        offset: int = 0
+        offset: int = 0,
+        fields: Optional[List[str]] = None
     ) -> List[Dict[str, Any]]:
-        """Получение истории расчётов пользователя"""
+        """
+        Получение истории расчётов пользователя (новые первыми)
+        
+        Airtable возвращает не больше offset + limit записей и, если указан
+        fields, только эти поля.
+        """
         
         try:
             # TODO: Добавить фильтрацию по user_id когда будет аутентификация
-            endpoint = f"{self.tables['calculations']}?pageSize={limit}"
+            params = [
+                ("maxRecords", offset + limit),
+                ("pageSize", min(offset + limit, 100)),
+                ("sort[0][field]", "CalculationDate"),
+                ("sort[0][direction]", "desc")
+            ]
+            params.extend(("fields[]", field) for field in fields or ())
+            endpoint = f"{self.tables['calculations']}?{urlencode(params)}"
             
             response = await self._make_request("GET", endpoint)
             
             if not response:
                 return []
             
-            calculations = []
-            for record in response.get("records", []):
-                calculations.append(record["fields"])
+            calculations = [record["fields"] for record in response.get("records", [])]
             
             return calculations[offset:offset + limit]
             
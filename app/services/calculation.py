@@ -3,15 +3,18 @@
 Основная бизнес-логика MVP
 """
 
+import asyncio
 from datetime import datetime
 from decimal import Decimal
-from typing import Dict, Any, List, Optional
+from types import MappingProxyType
+from typing import Dict, Any, List, NamedTuple, Optional
 
 import structlog
 
 from app.models.schemas import (
     CalculationRequest,
     CalculationResult,
+    CargoCategory,
     TNVEDInfo,
     DeliveryType
 )
@@ -20,6 +23,55 @@ from app.services.tnved import TNVEDService
 
 logger = structlog.get_logger(__name__)
 
+# Таможенные услуги без данных ТН ВЭД: только оформление
+_EMPTY_CUSTOMS = {
+    "customs_clearance": 50.0,  # Таможенное оформление
+    "duty": 0.0,
+    "vat": 0.0,
+    "total": 50.0
+}
+
+# Коэффициенты категорий для разных типов доставки
+_CARGO_CATEGORY_MULTIPLIERS = MappingProxyType({
+    "electronics": 1.1,
+    "clothing": 0.9,
+    "machinery": 1.3,
+    "chemicals": 1.5,
+    "food": 1.2,
+    "other": 1.0
+})
+
+_WHITE_CATEGORY_MULTIPLIERS = MappingProxyType({
+    "electronics": 1.2,
+    "clothing": 1.0,
+    "machinery": 1.4,
+    "chemicals": 1.6,
+    "food": 1.3,
+    "other": 1.1
+})
+
+# Коэффициенты для разных типов доставки
+_DELIVERY_COEFFICIENTS = MappingProxyType({
+    DeliveryType.CARGO: MappingProxyType({
+        "base_multiplier": 1.0,
+        "volume_multiplier": 1.2,  # Учитываем объём
+        "category_multipliers": _CARGO_CATEGORY_MULTIPLIERS
+    }),
+    DeliveryType.WHITE: MappingProxyType({
+        "base_multiplier": 1.8,  # Белая доставка дороже
+        "volume_multiplier": 1.1,
+        "category_multipliers": _WHITE_CATEGORY_MULTIPLIERS
+    })
+})
+
+
+class AdditionalServices(NamedTuple):
+    """Стоимость дополнительных услуг"""
+    insurance: float
+    packaging: float
+    documentation: float
+    total: float
+
 
 class CalculationService:
     """Сервис для расчёта стоимости доставки"""
@@ -29,32 +81,7 @@ class CalculationService:
         self.tnved_service = tnved_service
         
         # Коэффициенты для разных типов доставки
-        self.delivery_coefficients = {
-            DeliveryType.CARGO: {
-                "base_multiplier": 1.0,
-                "volume_multiplier": 1.2,  # Учитываем объём
-                "category_multipliers": {
-                    "electronics": 1.1,
-                    "clothing": 0.9,
-                    "machinery": 1.3,
-                    "chemicals": 1.5,
-                    "food": 1.2,
-                    "other": 1.0
-                }
-            },
-            DeliveryType.WHITE: {
-                "base_multiplier": 1.8,  # Белая доставка дороже
-                "volume_multiplier": 1.1,
-                "category_multipliers": {
-                    "electronics": 1.2,
-                    "clothing": 1.0,
-                    "machinery": 1.4,
-                    "chemicals": 1.6,
-                    "food": 1.3,
-                    "other": 1.1
-                }
-            }
-        }
+        self.delivery_coefficients = _DELIVERY_COEFFICIENTS
     
     async def calculate_delivery(
         self, 
@@ -79,9 +106,21 @@ class CalculationService:
                 volume=float(request.volume)
             )
             
-            # 1. Получаем тарифы для маршрута
+            # 1. Получаем тарифы для маршрута и 2. определяем ТН ВЭД код
             route = f"{request.origin.lower()}-{request.destination.lower()}"
-            tariffs = await self.airtable_service.get_tariffs(route=route)
+            tnved_info = None
+            if request.description:
+                # Запросы независимы - выполняем их параллельно
+                tariffs, tnved_info = await asyncio.gather(
+                    self.airtable_service.get_tariffs(route=route),
+                    self.tnved_service.classify_product(
+                        description=request.description,
+                        category=request.category,
+                        request_id=request_id
+                    )
+                )
+            else:
+                tariffs = await self.airtable_service.get_tariffs(route=route)
             
             if not tariffs:
                 # Если тарифы не найдены, используем базовые
@@ -92,26 +131,21 @@ class CalculationService:
                     route=route
                 )
             
-            # 2. Определяем ТН ВЭД код
-            tnved_info = None
-            if request.description:
-                tnved_info = await self.tnved_service.classify_product(
-                    description=request.description,
-                    category=request.category,
-                    request_id=request_id
-                )
-            
             # 3. Рассчитываем стоимость для каждого типа доставки
+            # (значение категории читается один раз на запрос)
+            cat_val = request.category.value
             cargo_delivery = await self._calculate_cargo_delivery(
                 request=request,
                 tariffs=tariffs,
-                tnved_info=tnved_info
+                tnved_info=tnved_info,
+                cat_val=cat_val
             )
             
             white_delivery = await self._calculate_white_delivery(
                 request=request,
                 tariffs=tariffs,
-                tnved_info=tnved_info
+                tnved_info=tnved_info,
+                cat_val=cat_val
             )
             
             # 4. Генерируем рекомендации
@@ -138,7 +172,7 @@ class CalculationService:
             )
             
             # 6. Сохраняем расчёт в Airtable
-            await self._save_calculation(request_id, request, result)
+            await self._save_calculation(request_id, request, result, cat_val)
             
             logger.info(
                 "Delivery calculation completed",
@@ -162,7 +196,8 @@ class CalculationService:
         self,
         request: CalculationRequest,
         tariffs: List,
-        tnved_info: Optional[TNVEDInfo]
+        tnved_info: Optional[TNVEDInfo],
+        cat_val: str
     ) -> Dict[str, Any]:
         """Расчёт стоимости карго доставки"""
         
@@ -178,9 +213,7 @@ class CalculationService:
             transit_time = cargo_tariff.transit_time_days
         
         # Применяем коэффициенты
-        category_multiplier = self.delivery_coefficients[DeliveryType.CARGO]["category_multipliers"].get(
-            request.category.value, 1.0
-        )
+        category_multiplier = _CARGO_CATEGORY_MULTIPLIERS.get(cat_val, 1.0)
         
         # Учитываем объём
         volume_weight = request.volume * 167  # 1 м³ = 167 кг
@@ -197,12 +230,12 @@ class CalculationService:
             tnved_info=tnved_info
         )
         
-        total_cost = adjusted_cost + additional_services["total"]
+        total_cost = float(adjusted_cost) + additional_services.total
         
         return {
-            "total_cost": float(total_cost),
+            "total_cost": total_cost,
             "base_cost": float(base_cost),
-            "additional_services": additional_services,
+            "additional_services": additional_services._asdict(),
             "transit_time": transit_time,
             "risk_level": "medium",
             "chargeable_weight": float(chargeable_weight),
@@ -213,7 +246,8 @@ class CalculationService:
         self,
         request: CalculationRequest,
         tariffs: List,
-        tnved_info: Optional[TNVEDInfo]
+        tnved_info: Optional[TNVEDInfo],
+        cat_val: str
     ) -> Dict[str, Any]:
         """Расчёт стоимости белой доставки"""
         
@@ -229,9 +263,7 @@ class CalculationService:
             transit_time = white_tariff.transit_time_days
         
         # Применяем коэффициенты
-        category_multiplier = self.delivery_coefficients[DeliveryType.WHITE]["category_multipliers"].get(
-            request.category.value, 1.0
-        )
+        category_multiplier = _WHITE_CATEGORY_MULTIPLIERS.get(cat_val, 1.0)
         
         # Учитываем объём
         volume_weight = request.volume * 167
@@ -242,10 +274,13 @@ class CalculationService:
         adjusted_cost = base_cost * Decimal(str(category_multiplier))
         
         # Добавляем таможенные услуги
-        customs_services = self._calculate_customs_services(
-            request=request,
-            tnved_info=tnved_info
-        )
+        if tnved_info is None:
+            customs_services = _EMPTY_CUSTOMS.copy()
+        else:
+            customs_services = self._calculate_customs_services(
+                request=request,
+                tnved_info=tnved_info
+            )
         
         # Добавляем дополнительные услуги
         additional_services = self._calculate_additional_services(
@@ -254,13 +289,13 @@ class CalculationService:
             tnved_info=tnved_info
         )
         
-        total_cost = adjusted_cost + customs_services["total"] + additional_services["total"]
+        total_cost = float(adjusted_cost) + customs_services["total"] + additional_services.total
         
         return {
-            "total_cost": float(total_cost),
+            "total_cost": total_cost,
             "base_cost": float(base_cost),
             "customs_services": customs_services,
-            "additional_services": additional_services,
+            "additional_services": additional_services._asdict(),
             "transit_time": transit_time,
             "risk_level": "low",
             "chargeable_weight": float(chargeable_weight),
@@ -277,7 +312,7 @@ class CalculationService:
         
         suitable_tariffs = [
             t for t in tariffs 
-            if t.service_type == delivery_type
+            if t.service_type is delivery_type
         ]
         
         if not suitable_tariffs:
@@ -294,23 +329,25 @@ class CalculationService:
     ) -> Dict[str, Any]:
         """Расчёт таможенных услуг"""
         
-        services = {
-            "customs_clearance": 50.0,  # Таможенное оформление
-            "duty": 0.0,
-            "vat": 0.0,
-            "total": 50.0
-        }
+        services = _EMPTY_CUSTOMS.copy()
         
-        if tnved_info and tnved_info.duty_rate:
+        if tnved_info is None:
+            return services
+        
+        weight = float(request.weight)
+        
+        duty_rate = tnved_info.duty_rate
+        if duty_rate:
             # Рассчитываем пошлину
-            duty_amount = float(request.weight) * float(tnved_info.duty_rate) / 100
+            duty_amount = weight * float(duty_rate) * 0.01
             services["duty"] = duty_amount
             services["total"] += duty_amount
         
-        if tnved_info and tnved_info.vat_rate:
+        vat_rate = tnved_info.vat_rate
+        if vat_rate:
             # Рассчитываем НДС
-            vat_base = float(request.weight) * 2.0  # Примерная стоимость товара
-            vat_amount = vat_base * float(tnved_info.vat_rate) / 100
+            vat_base = weight * 2.0  # Примерная стоимость товара
+            vat_amount = vat_base * float(vat_rate) * 0.01
             services["vat"] = vat_amount
             services["total"] += vat_amount
         
@@ -321,35 +358,25 @@ class CalculationService:
         request: CalculationRequest,
         delivery_type: DeliveryType,
         tnved_info: Optional[TNVEDInfo]
-    ) -> Dict[str, Any]:
+    ) -> AdditionalServices:
         """Расчёт дополнительных услуг"""
         
-        services = {
-            "insurance": 0.0,
-            "packaging": 0.0,
-            "documentation": 0.0,
-            "total": 0.0
-        }
-        
         # Страхование (1% от стоимости)
         estimated_value = float(request.weight) * 2.0  # Примерная стоимость
-        services["insurance"] = estimated_value * 0.01
+        insurance = estimated_value * 0.01
         
         # Упаковка
-        if request.volume > 1.0:
-            services["packaging"] = 30.0
-        else:
-            services["packaging"] = 15.0
+        packaging = 30.0 if request.volume > 1 else 15.0
         
         # Документооборот
-        if delivery_type == DeliveryType.WHITE:
-            services["documentation"] = 25.0
-        else:
-            services["documentation"] = 10.0
-        
-        services["total"] = services["insurance"] + services["packaging"] + services["documentation"]
+        documentation = 25.0 if delivery_type is DeliveryType.WHITE else 10.0
         
-        return services
+        return AdditionalServices(
+            insurance=insurance,
+            packaging=packaging,
+            documentation=documentation,
+            total=insurance + packaging + documentation
+        )
     
     def _generate_recommendations(
         self,
@@ -376,9 +403,10 @@ class CalculationService:
             recommendations.append(f"Необходимые документы: {', '.join(tnved_info.required_documents[:3])}")
         
         # Рекомендации по категории
-        if request.category.value == "electronics":
+        category = request.category
+        if category is CargoCategory.ELECTRONICS:
             recommendations.append("Для электроники рекомендуется дополнительная страховка")
-        elif request.category.value == "chemicals":
+        elif category is CargoCategory.CHEMICALS:
             recommendations.append("Для химии требуется специальная упаковка и разрешения")
         
         # Рекомендации по весу
@@ -413,7 +441,8 @@ class CalculationService:
         self, 
         request_id: str, 
         request: CalculationRequest, 
-        result: CalculationResult
+        result: CalculationResult,
+        cat_val: str
     ) -> None:
         """Сохранение расчёта в Airtable"""
         
@@ -422,7 +451,7 @@ class CalculationService:
                 "request_id": request_id,
                 "weight": float(request.weight),
                 "volume": float(request.volume),
-                "category": request.category.value,
+                "category": cat_val,
                 "origin": request.origin,
                 "destination": request.destination,
                 "cargo_cost": result.cargo_delivery["total_cost"],
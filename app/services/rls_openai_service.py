@@ -4,12 +4,11 @@ OpenAI сервис для AI Logistics Hub
 """
 
 import asyncio
-import json
-import logging
 from typing import Dict, Any, Optional, List
 from datetime import datetime
 
-import aiohttp
+import httpx
+import orjson
 import structlog
 
 from app.core.config import settings
@@ -17,93 +16,114 @@ from app.core.config import settings
 logger = structlog.get_logger(__name__)
 
 
+def _dumps(data: Any) -> str:
+    """Сериализация данных для промпта через orjson"""
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_INDENT_2).decode()
+
+
+def _err(message: str) -> Dict[str, Any]:
+    """Ответ с ошибкой"""
+    return {
+        "success": False,
+        "error": message,
+        "timestamp": datetime.now().isoformat()
+    }
+
+
 class OpenAIService:
     """Сервис для работы с OpenAI API"""
     
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.base_url = "https://api.openai.com/v1"
-        self.session: Optional[aiohttp.ClientSession] = None
         self.model = "gpt-4o-mini"  # Используем более доступную модель
+        # HTTP/2 клиент: параллельные запросы мультиплексируются в одном TLS-соединении
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=True,
+            timeout=30.0,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+        )
         
     async def __aenter__(self):
         """Асинхронный контекстный менеджер - вход"""
-        self.session = aiohttp.ClientSession()
         return self
         
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """Асинхронный контекстный менеджер - выход"""
-        if self.session:
-            await self.session.close()
+        await self.close()
+    
+    async def close(self) -> None:
+        """Закрытие HTTP клиента"""
+        await self.client.aclose()
     
     async def initialize(self) -> None:
         """Инициализация сервиса"""
         try:
-            # Проверяем подключение к OpenAI API
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            # Простой тест подключения
-            async with self.session.get(f"{self.base_url}/models", headers=headers) as response:
-                if response.status == 200:
-                    models = await response.json()
-                    logger.info(f"OpenAI service initialized. Available models: {len(models.get('data', []))}")
-                else:
-                    raise Exception(f"Failed to initialize OpenAI service: {response.status}")
+            # Простой тест подключения к OpenAI API
+            response = await self.client.get("/models")
+            if response.status_code == 200:
+                models = orjson.loads(response.content)
+                logger.info(f"OpenAI service initialized. Available models: {len(models.get('data', []))}")
+            else:
+                raise Exception(f"Failed to initialize OpenAI service: {response.status_code}")
                     
         except Exception as e:
             logger.error(f"Failed to initialize OpenAI service: {e}")
             raise
     
+    def _ok(self, key: str, value: str) -> Dict[str, Any]:
+        """Успешный ответ с результатом модели"""
+        return {
+            "success": True,
+            key: value,
+            "timestamp": datetime.now().isoformat(),
+            "model": self.model
+        }
+    
     async def _make_request(self, messages: List[Dict[str, str]], max_tokens: int = 1000) -> Optional[str]:
         """Выполнение запроса к OpenAI API"""
         try:
-            data = {
+            data = orjson.dumps({
                 "model": self.model,
                 "messages": messages,
                 "max_tokens": max_tokens,
                 "temperature": 0.7
-            }
+            })
             
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+            response = await self.client.post("/chat/completions", content=data)
             
-            async with self.session.post(
-                f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=30
-            ) as response:
-                
-                if response.status == 200:
-                    result = await response.json()
-                    content = result["choices"][0]["message"]["content"]
-                    logger.info(f"OpenAI request completed successfully")
-                    return content
-                else:
-                    error_text = await response.text()
-                    logger.error(f"OpenAI API error: {response.status} - {error_text}")
-                    return None
+            if response.status_code == 200:
+                result = orjson.loads(response.content)
+                content = result["choices"][0]["message"]["content"]
+                logger.info(f"OpenAI request completed successfully")
+                return content
+            else:
+                logger.error(f"OpenAI API error: {response.status_code} - {response.text}")
+                return None
                     
-        except asyncio.TimeoutError:
+        except httpx.TimeoutException:
             logger.error("OpenAI API request timeout")
             return None
-        except Exception as e:
+        except (httpx.HTTPError, ValueError) as e:
             logger.error(f"OpenAI API request failed: {e}")
             return None
+        except (KeyError, IndexError) as e:
+            # Ответ без choices[0].message.content
+            logger.error(f"Unexpected OpenAI API response: {e!r}")
+            return None
     
     async def interpret_tnved_data(self, tnved_data: Dict[str, Any]) -> Dict[str, Any]:
         """Интерпретация данных ТН ВЭД с помощью AI"""
-        try:
-            prompt = f"""
+        prompt = f"""
 Проанализируйте данные ТН ВЭД и предоставьте структурированный отчет на русском языке.
 
 Данные ТН ВЭД:
-{json.dumps(tnved_data, ensure_ascii=False, indent=2)}
+{_dumps(tnved_data)}
 
 Предоставьте анализ в следующем формате:
 1. Описание товара и его назначение
@@ -113,45 +133,24 @@ class OpenAIService:
 5. Рекомендации по таможенному оформлению
 
 Ответ должен быть структурированным и понятным для клиента.
-            """
-            
-            messages = [
-                {"role": "system", "content": "Вы - эксперт по таможенному оформлению и логистике. Анализируете ТН ВЭД коды и даете рекомендации по импорту товаров в Казахстан."},
-                {"role": "user", "content": prompt}
-            ]
-            
-            response = await self._make_request(messages, max_tokens=1500)
-            
-            if response:
-                return {
-                    "success": True,
-                    "interpretation": response,
-                    "timestamp": datetime.now().isoformat(),
-                    "model": self.model
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": "Failed to get AI interpretation",
-                    "timestamp": datetime.now().isoformat()
-                }
-                
-        except Exception as e:
-            logger.error(f"Error interpreting TNVED data: {e}")
-            return {
-                "success": False,
-                "error": str(e),
-                "timestamp": datetime.now().isoformat()
-            }
+        """
+        
+        messages = [
+            {"role": "system", "content": "Вы - эксперт по таможенному оформлению и логистике. Анализируете ТН ВЭД коды и даете рекомендации по импорту товаров в Казахстан."},
+            {"role": "user", "content": prompt}
+        ]
+        
+        response = await self._make_request(messages, max_tokens=1500)
+        
+        return self._ok("interpretation", response) if response else _err("Failed to get AI interpretation")
     
     async def analyze_supplier_report(self, supplier_data: Dict[str, Any]) -> Dict[str, Any]:
         """Анализ отчета о поставщике с помощью AI"""
-        try:
-            prompt = f"""
+        prompt = f"""
 Проанализируйте данные о китайском поставщике и предоставьте оценку надежности.
 
 Данные поставщика:
-{json.dumps(supplier_data, ensure_ascii=False, indent=2)}
+{_dumps(supplier_data)}
 
 Предоставьте анализ в следующем формате:
 1. Общая оценка надежности (1-10)
@@ -161,48 +160,27 @@ class OpenAIService:
 5. Альтернативные варианты (если есть риски)
 
 Ответ должен быть структурированным и содержать конкретные рекомендации.
-            """
-            
-            messages = [
-                {"role": "system", "content": "Вы - эксперт по проверке китайских поставщиков. Анализируете данные компаний и даете рекомендации по надежности и рискам."},
-                {"role": "user", "content": prompt}
-            ]
-            
-            response = await self._make_request(messages, max_tokens=1500)
-            
-            if response:
-                return {
-                    "success": True,
-                    "analysis": response,
-                    "timestamp": datetime.now().isoformat(),
-                    "model": self.model
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": "Failed to get AI analysis",
-                    "timestamp": datetime.now().isoformat()
-                }
-                
-        except Exception as e:
-            logger.error(f"Error analyzing supplier report: {e}")
-            return {
-                "success": False,
-                "error": str(e),
-                "timestamp": datetime.now().isoformat()
-            }
+        """
+        
+        messages = [
+            {"role": "system", "content": "Вы - эксперт по проверке китайских поставщиков. Анализируете данные компаний и даете рекомендации по надежности и рискам."},
+            {"role": "user", "content": prompt}
+        ]
+        
+        response = await self._make_request(messages, max_tokens=1500)
+        
+        return self._ok("analysis", response) if response else _err("Failed to get AI analysis")
     
     async def calculate_logistics(self, order_data: Dict[str, Any], tariffs: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Расчет логистики с помощью AI"""
-        try:
-            prompt = f"""
+        prompt = f"""
 Рассчитайте стоимость доставки и предоставьте рекомендации по логистике.
 
 Данные заказа:
-{json.dumps(order_data, ensure_ascii=False, indent=2)}
+{_dumps(order_data)}
 
 Доступные тарифы:
-{json.dumps(tariffs, ensure_ascii=False, indent=2)}
+{_dumps(tariffs)}
 
 Предоставьте расчет в следующем формате:
 1. Расчет стоимости карго доставки
@@ -213,36 +191,16 @@ class OpenAIService:
 6. Время в пути и риски
 
 Ответ должен содержать конкретные цифры и обоснованные рекомендации.
-            """
-            
-            messages = [
-                {"role": "system", "content": "Вы - эксперт по международной логистике. Рассчитываете стоимость доставки и даете рекомендации по выбору оптимального варианта."},
-                {"role": "user", "content": prompt}
-            ]
-            
-            response = await self._make_request(messages, max_tokens=2000)
-            
-            if response:
-                return {
-                    "success": True,
-                    "calculation": response,
-                    "timestamp": datetime.now().isoformat(),
-                    "model": self.model
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": "Failed to get AI calculation",
-                    "timestamp": datetime.now().isoformat()
-                }
-                
-        except Exception as e:
-            logger.error(f"Error calculating logistics: {e}")
-            return {
-                "success": False,
-                "error": str(e),
-                "timestamp": datetime.now().isoformat()
-            }
+        """
+        
+        messages = [
+            {"role": "system", "content": "Вы - эксперт по международной логистике. Рассчитываете стоимость доставки и даете рекомендации по выбору оптимального варианта."},
+            {"role": "user", "content": prompt}
+        ]
+        
+        response = await self._make_request(messages, max_tokens=2000)
+        
+        return self._ok("calculation", response) if response else _err("Failed to get AI calculation")
     
     async def generate_comprehensive_report(
         self, 
@@ -252,21 +210,20 @@ class OpenAIService:
         logistics_data: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Генерация комплексного отчета"""
-        try:
-            prompt = f"""
+        prompt = f"""
 Создайте комплексный отчет по заказу, включающий все аспекты: таможенное оформление, логистику и проверку поставщика.
 
 Данные заказа:
-{json.dumps(order_data, ensure_ascii=False, indent=2)}
+{_dumps(order_data)}
 
 Данные ТН ВЭД:
-{json.dumps(tnved_data, ensure_ascii=False, indent=2)}
+{_dumps(tnved_data)}
 
 Данные поставщика:
-{json.dumps(supplier_data, ensure_ascii=False, indent=2)}
+{_dumps(supplier_data)}
 
 Данные логистики:
-{json.dumps(logistics_data, ensure_ascii=False, indent=2)}
+{_dumps(logistics_data)}
 
 Создайте структурированный отчет:
 1. Краткое резюме заказа
@@ -277,41 +234,20 @@ class OpenAIService:
 6. Контакты для консультаций
 
 Отчет должен быть профессиональным и понятным для клиента.
-            """
-            
-            messages = [
-                {"role": "system", "content": "Вы - эксперт по международной торговле и логистике. Создаете комплексные отчеты для клиентов по импорту товаров из Китая в Казахстан."},
-                {"role": "user", "content": prompt}
-            ]
-            
-            response = await self._make_request(messages, max_tokens=3000)
-            
-            if response:
-                return {
-                    "success": True,
-                    "report": response,
-                    "timestamp": datetime.now().isoformat(),
-                    "model": self.model
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": "Failed to generate report",
-                    "timestamp": datetime.now().isoformat()
-                }
-                
-        except Exception as e:
-            logger.error(f"Error generating comprehensive report: {e}")
-            return {
-                "success": False,
-                "error": str(e),
-                "timestamp": datetime.now().isoformat()
-            }
+        """
+        
+        messages = [
+            {"role": "system", "content": "Вы - эксперт по международной торговле и логистике. Создаете комплексные отчеты для клиентов по импорту товаров из Китая в Казахстан."},
+            {"role": "user", "content": prompt}
+        ]
+        
+        response = await self._make_request(messages, max_tokens=3000)
+        
+        return self._ok("report", response) if response else _err("Failed to generate report")
     
     async def get_cost_estimate(self, text: str) -> Dict[str, Any]:
         """Получение примерной оценки стоимости по текстовому описанию"""
-        try:
-            prompt = f"""
+        prompt = f"""
 Оцените примерную стоимость доставки на основе описания товара.
 
 Описание: {text}
@@ -324,44 +260,50 @@ class OpenAIService:
 5. Дополнительные расходы
 
 Укажите, что это предварительная оценка и точный расчет требует детальных данных.
-            """
-            
-            messages = [
-                {"role": "system", "content": "Вы - эксперт по логистике. Даете предварительные оценки стоимости доставки на основе описания товаров."},
-                {"role": "user", "content": prompt}
-            ]
-            
-            response = await self._make_request(messages, max_tokens=1000)
-            
-            if response:
-                return {
-                    "success": True,
-                    "estimate": response,
-                    "timestamp": datetime.now().isoformat(),
-                    "model": self.model
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": "Failed to get cost estimate",
-                    "timestamp": datetime.now().isoformat()
-                }
-                
-        except Exception as e:
-            logger.error(f"Error getting cost estimate: {e}")
-            return {
-                "success": False,
-                "error": str(e),
-                "timestamp": datetime.now().isoformat()
-            }
+        """
+        
+        messages = [
+            {"role": "system", "content": "Вы - эксперт по логистике. Даете предварительные оценки стоимости доставки на основе описания товаров."},
+            {"role": "user", "content": prompt}
+        ]
+        
+        response = await self._make_request(messages, max_tokens=1000)
+        
+        return self._ok("estimate", response) if response else _err("Failed to get cost estimate")
+
+
+# Один экземпляр сервиса (и пул соединений его HTTP клиента) на процесс
+_service: Optional[OpenAIService] = None
+_service_lock = asyncio.Lock()
 
 
 # Функция для получения экземпляра сервиса
 async def get_openai_service() -> OpenAIService:
     """Получение экземпляра OpenAI сервиса"""
+    global _service
+    
+    if _service is not None:
+        return _service
+    
     if not settings.OPENAI_API_KEY:
         raise ValueError("OPENAI_API_KEY not configured")
     
-    service = OpenAIService(settings.OPENAI_API_KEY)
-    await service.initialize()
-    return service
+    async with _service_lock:
+        if _service is None:
+            service = OpenAIService(settings.OPENAI_API_KEY)
+            try:
+                await service.initialize()
+            except Exception:
+                await service.close()
+                raise
+            _service = service
+    return _service
+
+
+async def close_openai_service() -> None:
+    """Закрытие экземпляра OpenAI сервиса при остановке приложения"""
+    global _service
+    
+    if _service is not None:
+        await _service.close()
+        _service = None
@@ -3,230 +3,333 @@ Qichacha сервис для проверки китайских поставщ
 """
 
 import asyncio
+import copy
+import functools
 import hashlib
+import inspect
+import re
 import time
-import json
-from typing import Dict, Any, Optional
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
 import aiohttp
+import orjson
 import structlog
 
+from app.core.cache import TTLCache
 from app.core.config import settings
+from app.core.retry import retry_delay
+from app.core.singleflight import SingleFlight
 
 logger = structlog.get_logger(__name__)
 
+# Единицы и разделители уставного капитала ("1,000 万元" -> "1000")
+_CAPITAL_RE = re.compile(r"[万元,\s]")
+# Год в дате регистрации ("2015-03-20", "2015年3月20日")
+_YEAR_RE = re.compile(r"\d{4}")
+
+
+def _normalize_name(company_name: str) -> str:
+    """Нормализация названия компании для ключа"""
+    return company_name.lower().strip()
+
+
+def _single_flight(kind: str, normalize: Optional[Callable[[str], str]] = None, cache: bool = False):
+    """
+    Объединение одновременных одинаковых вызовов метода сервиса
+    
+    Ключ - (kind, аргументы вызова; первый нормализуется normalize).
+    Пока запрос с таким ключом выполняется, остальные вызовы ждут его
+    результат. При cache=True успешные ответы дополнительно сохраняются
+    в TTL-кэше сервиса. Каждый вызывающий получает свою копию ответа.
+    """
+    def decorator(func: Callable[..., Awaitable[Dict[str, Any]]]):
+        signature = inspect.signature(func)
+        
+        @functools.wraps(func)
+        async def wrapper(self: "QichachaService", *args: Any, **kwargs: Any) -> Dict[str, Any]:
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            value, *rest = list(bound.arguments.values())[1:]
+            key = (kind, normalize(value) if normalize else value, *rest)
+            
+            if cache:
+                cached = self._cache.get(key)
+                if cached is not None:
+                    return copy.deepcopy(cached)
+            
+            async def fetch() -> Dict[str, Any]:
+                result = await func(*bound.args, **bound.kwargs)
+                if cache and result.get("success") is True:
+                    self._cache.set(key, result)
+                return result
+            
+            return copy.deepcopy(await self._flights.do(key, fetch))
+        
+        return wrapper
+    return decorator
+
+
+def _cached(kind: str, normalize: Optional[Callable[[str], str]] = None):
+    """Кэширование успешных ответов метода сервиса (с объединением одновременных вызовов)"""
+    return _single_flight(kind, normalize, cache=True)
+
 
 class QichachaService:
     """Сервис для работы с Qichacha API"""
     
-    def __init__(self, api_key: str, secret_key: str):
+    __slots__ = (
+        "api_key",
+        "secret_key",
+        "_secret_key_bytes",
+        "_hash_factory",
+        "base_url",
+        "_session",
+        "_cache",
+        "_flights"
+    )
+    
+    # Признаки действующей и ликвидированной компании в поле Status
+    _ACTIVE_TOKENS = frozenset({"active", "正常", "存续", "在营"})
+    _DEAD_TOKENS = frozenset({"cancelled", "吊销", "注销"})
+    
+    # Повтор запросов при временных ошибках API
+    MAX_ATTEMPTS = 3
+    _RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+    
+    def __init__(self, api_key: str, secret_key: str, hash_factory: Callable[[], Any] = hashlib.md5):
         self.api_key = api_key
         self.secret_key = secret_key
+        self._secret_key_bytes = secret_key.encode('utf-8')
+        # Алгоритм подписи (Qichacha требует MD5)
+        self._hash_factory = hash_factory
         self.base_url = "https://open.qichacha.com"
-        self.session: Optional[aiohttp.ClientSession] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        # Кэш успешных ответов API и выполняющиеся запросы
+        self._cache = TTLCache(maxsize=1024, ttl=3600)
+        self._flights = SingleFlight()
         
     async def __aenter__(self):
         """Асинхронный контекстный менеджер - вход"""
-        self.session = aiohttp.ClientSession()
         return self
         
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """Асинхронный контекстный менеджер - выход"""
-        if self.session:
-            await self.session.close()
+        await self.aclose()
     
-    async def initialize(self) -> None:
-        """Инициализация сервиса"""
-        try:
-            # Простой тест подключения
-            test_result = await self.search_company("test")
-            logger.info("Qichacha service initialized successfully")
-            
-        except Exception as e:
-            logger.error(f"Failed to initialize Qichacha service: {e}")
-            raise
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Получение общей HTTP сессии (создаётся лениво, переиспользует соединения)"""
+        if self._session is None or self._session.closed:
+            # Все запросы идут на один хост: кэшируем DNS, куки не нужны (API без состояния)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=30,
+                    limit_per_host=30,
+                    ttl_dns_cache=600,
+                    use_dns_cache=True,
+                    enable_cleanup_closed=True
+                ),
+                cookie_jar=aiohttp.DummyCookieJar(),
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+        return self._session
     
-    def _generate_signature(self, params: Dict[str, Any]) -> str:
-        """Генерация подписи для API запроса"""
-        # Сортируем параметры по ключу
-        sorted_params = dict(sorted(params.items()))
+    async def aclose(self) -> None:
+        """Закрытие HTTP сессии"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def initialize(self, verify: bool = False) -> None:
+        """
+        Инициализация сервиса
         
-        # Создаем строку для подписи
-        sign_string = ""
-        for key, value in sorted_params.items():
-            sign_string += f"{key}{value}"
+        Сессия создаётся лениво при первом запросе. Проверка подключения
+        (живой поиск в API) выполняется только при verify=True.
+        """
+        if verify and not await self.ping():
+            raise Exception("Failed to initialize Qichacha service: API is unavailable")
         
-        # Добавляем секретный ключ
-        sign_string += self.secret_key
+        logger.info("Qichacha service initialized successfully")
+    
+    async def ping(self) -> bool:
+        """Проверка подключения к Qichacha API"""
+        try:
+            return await self._make_request("/api/search/search", {
+                "keyword": "test",
+                "pageIndex": "1",
+                "pageSize": "1"
+            }) is not None
+        except Exception as e:
+            logger.error(f"Qichacha API ping failed: {e}")
+            return False
+    
+    def _generate_signature(self, items: List[Tuple[str, Any]]) -> str:
+        """Генерация подписи для API запроса по отсортированным по ключу параметрам"""
+        # Строка подписи: параметры по порядку и секретный ключ.
+        # Передаём части сразу в хеш, не собирая промежуточную строку
+        digest = self._hash_factory()
+        update = digest.update
+        for key, value in items:
+            update(key.encode('utf-8'))
+            update(value if isinstance(value, (bytes, bytearray)) else str(value).encode('utf-8'))
+        update(self._secret_key_bytes)
         
-        # Создаем MD5 хеш
-        signature = hashlib.md5(sign_string.encode('utf-8')).hexdigest().upper()
-        return signature
+        return digest.hexdigest().upper()
     
     async def _make_request(self, endpoint: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Выполнение запроса к Qichacha API"""
         try:
-            # Добавляем обязательные параметры
-            params.update({
+            # Добавляем обязательные параметры, не изменяя params вызывающего
+            items = sorted({
+                **params,
                 "appKey": self.api_key,
-                "timestamp": str(int(time.time() * 1000))
-            })
+                "timestamp": format(time.time_ns() // 1_000_000, "d")
+            }.items())
             
             # Генерируем подпись
-            signature = self._generate_signature(params)
-            params["sign"] = signature
+            query = [*items, ("sign", self._generate_signature(items))]
             
             url = f"{self.base_url}{endpoint}"
             
-            async with self.session.get(url, params=params, timeout=30) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    logger.info(f"Qichacha API request completed: {endpoint}")
-                    return result
-                else:
-                    error_text = await response.text()
-                    logger.error(f"Qichacha API error: {response.status} - {error_text}")
-                    return None
+            session = await self._get_session()
+            for attempt in range(self.MAX_ATTEMPTS):
+                async with session.get(url, params=query) as response:
+                    if response.status == 200:
+                        # Ответ разбирается целиком: детали, риски и финансы
+                        # возвращаются в отчёте полностью, а не только поля для оценки
+                        result = orjson.loads(await response.read())
+                        logger.info(f"Qichacha API request completed: {endpoint}")
+                        return result
+                    
+                    if response.status in self._RETRY_STATUSES and attempt + 1 < self.MAX_ATTEMPTS:
+                        delay = retry_delay(attempt, response.headers.get("Retry-After"))
+                        logger.warning(
+                            f"Qichacha API error: {response.status}, retrying in {delay:.2f}s "
+                            f"(attempt {attempt + 1}/{self.MAX_ATTEMPTS})"
+                        )
+                    else:
+                        error_text = await response.text()
+                        logger.error(f"Qichacha API error: {response.status} - {error_text}")
+                        return None
+                
+                await asyncio.sleep(delay)
                     
         except asyncio.TimeoutError:
             logger.error("Qichacha API request timeout")
             return None
-        except Exception as e:
+        except aiohttp.ClientError as e:
             logger.error(f"Qichacha API request failed: {e}")
             return None
+        except ValueError as e:
+            logger.error(f"Invalid Qichacha API response: {e}")
+            return None
     
+    @_cached("search", normalize=_normalize_name)
     async def search_company(self, company_name: str) -> Dict[str, Any]:
         """Поиск компании по названию"""
-        try:
-            params = {
-                "keyword": company_name,
-                "pageIndex": "1",
-                "pageSize": "10"
-            }
-            
-            result = await self._make_request("/api/search/search", params)
+        params = {
+            "keyword": company_name,
+            "pageIndex": "1",
+            "pageSize": "10"
+        }
+        
+        result = await self._make_request("/api/search/search", params)
+        
+        if result and result.get("Status") == "200":
+            companies = result.get("Result", {}).get("List", [])
             
-            if result and result.get("Status") == "200":
-                companies = result.get("Result", {}).get("List", [])
-                
-                if companies:
-                    # Возвращаем первую найденную компанию
-                    return {
-                        "success": True,
-                        "company": companies[0],
-                        "total_count": result.get("Result", {}).get("TotalCount", 0)
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": "Company not found",
-                        "message": f"No companies found for '{company_name}'"
-                    }
+            if companies:
+                # Возвращаем первую найденную компанию
+                return {
+                    "success": True,
+                    "company": companies[0],
+                    "total_count": result.get("Result", {}).get("TotalCount", 0)
+                }
             else:
                 return {
                     "success": False,
-                    "error": "API error",
-                    "message": result.get("Message", "Unknown error") if result else "No response"
+                    "error": "Company not found",
+                    "message": f"No companies found for '{company_name}'"
                 }
-                
-        except Exception as e:
-            logger.error(f"Error searching company: {e}")
+        else:
             return {
                 "success": False,
-                "error": str(e)
+                "error": "API error",
+                "message": result.get("Message", "Unknown error") if result else "No response"
             }
     
+    @_cached("details")
     async def get_company_details(self, company_id: str) -> Dict[str, Any]:
         """Получение детальной информации о компании"""
-        try:
-            params = {
-                "keyNo": company_id
-            }
-            
-            result = await self._make_request("/api/company/getDetail", params)
+        params = {
+            "keyNo": company_id
+        }
+        
+        result = await self._make_request("/api/company/getDetail", params)
+        
+        if result and result.get("Status") == "200":
+            company_data = result.get("Result", {})
             
-            if result and result.get("Status") == "200":
-                company_data = result.get("Result", {})
-                
-                return {
-                    "success": True,
-                    "company": company_data
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": "API error",
-                    "message": result.get("Message", "Unknown error") if result else "No response"
-                }
-                
-        except Exception as e:
-            logger.error(f"Error getting company details: {e}")
+            return {
+                "success": True,
+                "company": company_data
+            }
+        else:
             return {
                 "success": False,
-                "error": str(e)
+                "error": "API error",
+                "message": result.get("Message", "Unknown error") if result else "No response"
             }
     
+    @_cached("risk")
     async def check_company_risk(self, company_id: str) -> Dict[str, Any]:
         """Проверка рисков компании"""
-        try:
-            params = {
-                "keyNo": company_id
-            }
-            
-            result = await self._make_request("/api/company/getRisk", params)
+        params = {
+            "keyNo": company_id
+        }
+        
+        result = await self._make_request("/api/company/getRisk", params)
+        
+        if result and result.get("Status") == "200":
+            risk_data = result.get("Result", {})
             
-            if result and result.get("Status") == "200":
-                risk_data = result.get("Result", {})
-                
-                return {
-                    "success": True,
-                    "risk_info": risk_data
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": "API error",
-                    "message": result.get("Message", "Unknown error") if result else "No response"
-                }
-                
-        except Exception as e:
-            logger.error(f"Error checking company risk: {e}")
+            return {
+                "success": True,
+                "risk_info": risk_data
+            }
+        else:
             return {
                 "success": False,
-                "error": str(e)
+                "error": "API error",
+                "message": result.get("Message", "Unknown error") if result else "No response"
             }
     
+    @_cached("financials")
     async def get_company_financials(self, company_id: str) -> Dict[str, Any]:
         """Получение финансовой информации"""
-        try:
-            params = {
-                "keyNo": company_id
-            }
-            
-            result = await self._make_request("/api/company/getFinancial", params)
+        params = {
+            "keyNo": company_id
+        }
+        
+        result = await self._make_request("/api/company/getFinancial", params)
+        
+        if result and result.get("Status") == "200":
+            financial_data = result.get("Result", {})
             
-            if result and result.get("Status") == "200":
-                financial_data = result.get("Result", {})
-                
-                return {
-                    "success": True,
-                    "financials": financial_data
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": "API error",
-                    "message": result.get("Message", "Unknown error") if result else "No response"
-                }
-                
-        except Exception as e:
-            logger.error(f"Error getting company financials: {e}")
+            return {
+                "success": True,
+                "financials": financial_data
+            }
+        else:
             return {
                 "success": False,
-                "error": str(e)
+                "error": "API error",
+                "message": result.get("Message", "Unknown error") if result else "No response"
             }
     
+    @_single_flight("check", normalize=_normalize_name)
     async def comprehensive_supplier_check(self, company_name: str) -> Dict[str, Any]:
         """Комплексная проверка поставщика"""
         try:
@@ -245,14 +348,27 @@ class QichachaService:
                     "error": "Company ID not found"
                 }
             
-            # 2. Получение детальной информации
-            details_result = await self.get_company_details(company_id)
-            
-            # 3. Проверка рисков
-            risk_result = await self.check_company_risk(company_id)
-            
-            # 4. Получение финансовой информации
-            financial_result = await self.get_company_financials(company_id)
+            if self._is_dead(company):
+                # Ликвидированная компания: детали не изменят вывод, не тратим на них запросы
+                details, risks, financials = {}, {}, {}
+                reliability_score = 1
+            else:
+                # 2-4. Детальная информация, риски и финансы зависят только от company_id,
+                # поэтому запрашиваем их параллельно
+                details_result, risk_result, financial_result = [
+                    {"success": False, "error": str(result)} if isinstance(result, Exception) else result
+                    for result in await asyncio.gather(
+                        self.get_company_details(company_id),
+                        self.check_company_risk(company_id),
+                        self.get_company_financials(company_id),
+                        return_exceptions=True
+                    )
+                ]
+                
+                details = details_result.get("company", {}) if details_result.get("success") else {}
+                risks = risk_result.get("risk_info", {}) if risk_result.get("success") else {}
+                financials = financial_result.get("financials", {}) if financial_result.get("success") else {}
+                reliability_score = self._calculate_reliability_score(company, details, risks, financials)
             
             # 5. Формирование комплексного отчета
             comprehensive_report = {
@@ -273,21 +389,16 @@ class QichachaService:
                 },
                 
                 # Детальная информация
-                "details": details_result.get("company", {}) if details_result.get("success") else {},
+                "details": details,
                 
                 # Информация о рисках
-                "risks": risk_result.get("risk_info", {}) if risk_result.get("success") else {},
+                "risks": risks,
                 
                 # Финансовая информация
-                "financials": financial_result.get("financials", {}) if financial_result.get("success") else {},
+                "financials": financials,
                 
                 # Оценка надежности
-                "reliability_score": self._calculate_reliability_score(
-                    company, 
-                    details_result.get("company", {}),
-                    risk_result.get("risk_info", {}),
-                    financial_result.get("financials", {})
-                )
+                "reliability_score": reliability_score
             }
             
             return comprehensive_report
@@ -299,39 +410,63 @@ class QichachaService:
                 "error": str(e)
             }
     
+    async def batch_supplier_check(self, company_names: List[str], concurrency: int = 10) -> List[Dict[str, Any]]:
+        """
+        Комплексная проверка нескольких поставщиков
+        
+        Проверки выполняются параллельно, не более concurrency одновременно,
+        чтобы не исчерпать пул соединений. Результаты в порядке company_names.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def check_one(company_name: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.comprehensive_supplier_check(company_name)
+        
+        results = await asyncio.gather(
+            *(check_one(company_name) for company_name in company_names),
+            return_exceptions=True
+        )
+        
+        return [
+            {"success": False, "company_name": company_name, "error": str(result)}
+            if isinstance(result, Exception) else result
+            for company_name, result in zip(company_names, results)
+        ]
+    
+    def _is_dead(self, company: Dict) -> bool:
+        """Компания ликвидирована или лицензия отозвана"""
+        status = (company.get("Status") or "").lower()
+        return any(token in status for token in self._DEAD_TOKENS)
+    
     def _calculate_reliability_score(self, company: Dict, details: Dict, risks: Dict, financials: Dict) -> int:
         """Расчет оценки надежности поставщика (1-10)"""
         score = 5  # Базовая оценка
         
         try:
             # Проверка статуса компании
-            status = company.get("Status", "").lower()
-            if "active" in status or "正常" in status:
+            status = (company.get("Status") or "").lower()
+            if any(token in status for token in self._ACTIVE_TOKENS):
                 score += 2
-            elif "cancelled" in status or "吊销" in status:
+            elif self._is_dead(company):
                 score -= 3
             
             # Проверка уставного капитала
             reg_capital = company.get("RegCapital", "")
             if reg_capital:
                 try:
-                    capital_value = float(reg_capital.replace("万", "").replace("万元", ""))
+                    capital_value = float(_CAPITAL_RE.sub("", reg_capital))
                     if capital_value > 1000:
                         score += 1
                     elif capital_value > 100:
                         score += 0.5
-                except:
+                except ValueError:
                     pass
             
-            # Проверка даты регистрации
-            establish_time = company.get("EstablishTime", "")
-            if establish_time:
-                try:
-                    # Примерная проверка - компания старше 3 лет
-                    if "2019" in establish_time or "2018" in establish_time:
-                        score += 1
-                except:
-                    pass
+            # Проверка даты регистрации - компания старше 3 лет
+            year_match = _YEAR_RE.search(company.get("EstablishTime") or "")
+            if year_match and datetime.now().year - int(year_match.group()) >= 3:
+                score += 1
             
             # Проверка рисков
             if risks:
@@ -353,13 +488,34 @@ class QichachaService:
         return score
 
 
+# Единственный экземпляр сервиса (общий пул соединений)
+_service: Optional[QichachaService] = None
+_service_lock = asyncio.Lock()
+
+
 # Функция для получения экземпляра сервиса
 async def get_qichacha_service() -> QichachaService:
     """Получение экземпляра Qichacha сервиса"""
+    global _service
+    
+    if _service is not None:
+        return _service
+    
     if not settings.QICHACHA_API_KEY or not settings.QICHACHA_SECRET_KEY:
         raise ValueError("QICHACHA_API_KEY and QICHACHA_SECRET_KEY not configured")
     
-    service = QichachaService(settings.QICHACHA_API_KEY, settings.QICHACHA_SECRET_KEY)
-    await service.initialize()
-    return service
+    async with _service_lock:
+        if _service is None:
+            service = QichachaService(settings.QICHACHA_API_KEY, settings.QICHACHA_SECRET_KEY)
+            await service.initialize()
+            _service = service
+    return _service
+
 
+async def close_qichacha_service() -> None:
+    """Закрытие экземпляра Qichacha сервиса при остановке приложения"""
+    global _service
+    
+    if _service is not None:
+        await _service.aclose()
+        _service = None
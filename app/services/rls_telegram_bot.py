@@ -4,27 +4,243 @@ Telegram Bot сервис для AI Logistics Hub
 """
 
 import asyncio
-import json
 import logging
-from typing import Dict, Any, Optional
-from datetime import datetime
+import re
+import time
+from typing import Coroutine, Dict, Any, List, Optional, Set, Tuple, Union
 
 import aiohttp
+import orjson
 import structlog
+from pydantic import ValidationError
+from redis import asyncio as aioredis
+from yarl import URL
 
+from app.core.cache import TTLCache
 from app.core.config import settings
+from app.models.schemas import BotCalculationInput
 from app.services.airtable import AirtableService
 from app.services.rls_tnved_info import TNVEDInfoService
 
 logger = structlog.get_logger(__name__)
 
 
+def _json_serialize(data: Any) -> str:
+    """Сериализация тела запросов к Telegram API через orjson"""
+    return orjson.dumps(data).decode()
+
+
+def _reply_markup(keyboard: List[List[str]]) -> orjson.Fragment:
+    """Разметка клавиатуры, сериализованная заранее (вставляется в тело запроса как есть)"""
+    return orjson.Fragment(orjson.dumps({
+        "keyboard": keyboard,
+        "resize_keyboard": True,
+        "one_time_keyboard": False
+    }))
+
+
+# Строка данных для расчета: "Ключ: значение" (ключ может продолжаться, например "Вес груза")
+_CALCULATION_LINE_RE = re.compile(
+    r"^\s*(?P<key>вес|объ[её]м|откуда|отправление|куда|назначение|товар|описание)[^:\n]*:\s*(?P<value>.+?)\s*$",
+    re.IGNORECASE | re.MULTILINE
+)
+_CALCULATION_FIELDS = {
+    "вес": "weight",
+    "объем": "volume",
+    "объём": "volume",
+    "откуда": "origin",
+    "отправление": "origin",
+    "куда": "destination",
+    "назначение": "destination",
+    "товар": "description",
+    "описание": "description"
+}
+
+
+# Статические клавиатуры бота
+MAIN_KEYBOARD = [
+    ["📦 Расчет доставки", "🔍 Поиск ТН ВЭД"],
+    ["🏢 Проверка поставщика", "📊 Мои расчеты"],
+    ["ℹ️ Помощь", "📞 Связаться с менеджером"]
+]
+CALCULATION_KEYBOARD = [
+    ["🔙 Назад", "📋 Пример расчета"],
+    ["❓ Как пользоваться"]
+]
+
+_MAIN_MARKUP = _reply_markup(MAIN_KEYBOARD)
+_CALCULATION_MARKUP = _reply_markup(CALCULATION_KEYBOARD)
+_BACK_MARKUP = _reply_markup([["🔙 Назад"]])
+_CALCULATION_RESULT_MARKUP = _reply_markup([["📦 Новый расчет", "📊 Мои расчеты"], ["🔙 Главное меню"]])
+_TNVED_RESULT_MARKUP = _reply_markup([["🔍 Новый поиск"], ["🔙 Главное меню"]])
+_SUPPLIER_RESULT_MARKUP = _reply_markup([["🏢 Проверить другого"], ["🔙 Главное меню"]])
+
+
+# Статические тексты сообщений бота
+_WELCOME_TEXT = """
+🤖 <b>Добро пожаловать в AI Logistics Hub!</b>
+
+Я помогу вам рассчитать стоимость доставки из Китая в Казахстан, найти ТН ВЭД коды и проверить поставщиков.
+
+<b>Что я умею:</b>
+• 📦 Расчет стоимости карго и белой доставки
+• 🔍 Поиск и классификация ТН ВЭД кодов
+• 🏢 Проверка китайских поставщиков
+• 📊 История ваших расчетов
+
+Выберите нужную опцию:
+"""
+
+_INSTRUCTION_CALCULATION = """
+📦 <b>Расчет стоимости доставки</b>
+
+Для расчета мне нужна следующая информация:
+
+<b>1. Вес груза (кг)</b>
+<b>2. Объем груза (м³)</b>
+<b>3. Город отправления</b>
+<b>4. Город назначения</b>
+<b>5. Описание товара</b>
+
+Отправьте данные в формате:
+<code>
+Вес: 100
+Объем: 0.5
+Откуда: Shenzhen
+Куда: Almaty
+Товар: LED лампы, 10W, E27
+</code>
+
+Или нажмите "📋 Пример расчета" для демонстрации.
+"""
+
+_INSTRUCTION_TNVED = """
+🔍 <b>Поиск ТН ВЭД кода</b>
+
+Опишите ваш товар максимально подробно, и я найду подходящий ТН ВЭД код.
+
+<b>Примеры запросов:</b>
+• LED лампы светодиодные 10W E27 цоколь
+• Одежда детская хлопковая футболки
+• Электроника смартфоны мобильные телефоны
+
+Отправьте описание товара:
+"""
+
+_INSTRUCTION_SUPPLIER = """
+🏢 <b>Проверка китайского поставщика</b>
+
+Для проверки поставщика мне нужна следующая информация:
+
+<b>1. Название компании</b>
+<b>2. Регистрационный номер (если есть)</b>
+
+Отправьте данные в формате:
+<code>
+Компания: Shenzhen Electronics Co., Ltd.
+Рег. номер: 91440300XXXXXXXXXX
+</code>
+
+Или просто название компании, если номер неизвестен.
+"""
+
+_HELP_TEXT = """
+ℹ️ <b>Справка по использованию бота</b>
+
+<b>📦 Расчет доставки</b>
+• Укажите вес, объем, города и описание товара
+• Получите расчет для карго и белой доставки
+• Сравните варианты и выберите оптимальный
+
+<b>🔍 Поиск ТН ВЭД</b>
+• Опишите товар подробно
+• Получите точный ТН ВЭД код
+• Узнайте ставки пошлин и требования
+
+<b>🏢 Проверка поставщика</b>
+• Укажите название китайской компании
+• Получите отчет о надежности
+• Узнайте риски и рекомендации
+
+<b>📞 Поддержка</b>
+По всем вопросам обращайтесь к менеджеру:
+• Telegram: @manager_username
+• Email: support@ailogistics.kz
+• Телефон: +7 XXX XXX XX XX
+"""
+
+_CALCULATION_EXAMPLE_TEXT = """
+📋 <b>Пример расчета доставки</b>
+
+Отправьте данные в таком формате:
+
+<code>
+Вес: 100
+Объем: 0.5
+Откуда: Shenzhen
+Куда: Almaty
+Товар: LED лампы светодиодные 10W E27 цоколь белый свет
+</code>
+
+После отправки я рассчитаю стоимость карго и белой доставки.
+"""
+
+_CALCULATION_HOWTO_TEXT = """
+❓ <b>Как пользоваться расчетом</b>
+
+1. <b>Вес груза</b> - укажите в килограммах
+2. <b>Объем груза</b> - укажите в кубических метрах
+3. <b>Город отправления</b> - обычно Shenzhen, Guangzhou, Shanghai
+4. <b>Город назначения</b> - ваш город в Казахстане
+5. <b>Описание товара</b> - подробное описание для определения ТН ВЭД
+
+<b>Пример:</b>
+Вес: 50
+Объем: 0.3
+Откуда: Shenzhen
+Куда: Almaty
+Товар: Электронные компоненты, микросхемы, резисторы
+"""
+
+
+# Обработчики кнопок главного меню и состояний пользователя (имена методов TelegramBotService)
+_MAIN_MENU_HANDLERS = {
+    "📦 Расчет доставки": "handle_calculation_request",
+    "🔍 Поиск ТН ВЭД": "handle_tnved_search",
+    "🏢 Проверка поставщика": "handle_supplier_check",
+    "📊 Мои расчеты": "handle_calculation_history",
+    "ℹ️ Помощь": "handle_help",
+    "📞 Связаться с менеджером": "handle_contact_manager",
+    "🔙 Назад": "handle_back_to_main_menu"
+}
+_STATE_HANDLERS = {
+    "main_menu": "handle_main_menu",
+    "waiting_calculation_data": "handle_calculation_data",
+    "waiting_tnved_query": "handle_tnved_query",
+    "waiting_supplier_info": "handle_supplier_info"
+}
+
+
 class TelegramBotService:
     """Сервис для работы с Telegram Bot API"""
     
+    # Одновременных запросов sendMessage (глобальный лимит Telegram ~30 сообщений/с)
+    MAX_CONCURRENT_SENDS = 30
+    
+    # Время жизни состояния пользователя (секунды)
+    USER_STATE_TTL = 3600
+    
+    # Типы обновлений, которые обрабатывает бот (остальные Telegram не присылает)
+    ALLOWED_UPDATES = ["message"]
+    
     def __init__(self, token: str):
         self.token = token
         self.base_url = f"https://api.telegram.org/bot{token}"
+        
+        # URL методов разбираются один раз, а не при каждом запросе
+        self._api_url = URL(self.base_url)
+        self._url_get_me = self._api_url / "getMe"
+        self._url_send_message = self._api_url / "sendMessage"
         self.session: Optional[aiohttp.ClientSession] = None
         
         # Инициализируем другие сервисы
@@ -37,30 +253,111 @@ class TelegramBotService:
             password=settings.TNVED_INFO_PASSWORD
         )
         
-        # Состояния пользователей (для FSM)
-        self.user_states: Dict[int, Dict[str, Any]] = {}
+        # Состояния пользователей (для FSM) хранятся в Redis: общие для всех
+        # воркеров бота и удаляются после USER_STATE_TTL секунд бездействия.
+        # Без REDIS_URL - в памяти процесса (только для одного воркера)
+        self.redis = aioredis.from_url(settings.REDIS_URL) if settings.REDIS_URL else None
+        self._states = TTLCache(maxsize=100_000, ttl=self.USER_STATE_TTL)
+        if self.redis is None:
+            logger.warning("REDIS_URL not configured, bot states are kept in memory")
+        
+        # Кэш тарифов (меняются редко) и результатов поиска ТН ВЭД (описания повторяются)
+        self._tariffs_cache = TTLCache(maxsize=1, ttl=300)
+        self._tnved_cache = TTLCache(maxsize=2048, ttl=3600)
+        
+        # Очередь исходящих сообщений и фоновый отправитель
+        self._send_queue: "asyncio.Queue[Tuple[Dict[str, Any], asyncio.Future]]" = asyncio.Queue()
+        self._send_semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_SENDS)
+        self._send_tasks: Set[asyncio.Task] = set()
+        self._sender_task: Optional[asyncio.Task] = None
+        
+        # Фоновые задачи (записи в Airtable), которые пользователь не ждёт
+        self._bg_tasks: Set[asyncio.Task] = set()
+        
+        # Блокировки по чатам: сообщения одного пользователя обрабатываются
+        # по очереди, чтобы переходы состояний не перемешивались
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_waiters: Dict[int, int] = {}
         
     async def __aenter__(self):
         """Асинхронный контекстный менеджер - вход"""
-        self.session = aiohttp.ClientSession()
+        await self._get_session()
         return self
         
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """Асинхронный контекстный менеджер - выход"""
-        if self.session:
+        await self.aclose()
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Получение общей HTTP сессии с пулом keep-alive соединений"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=200,
+                    limit_per_host=100,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=75,
+                    enable_cleanup_closed=True
+                ),
+                timeout=aiohttp.ClientTimeout(total=30),
+                json_serialize=_json_serialize
+            )
+        return self.session
+    
+    def _spawn_bg(self, coro: Coroutine[Any, Any, Any], description: str) -> None:
+        """Запуск фоновой задачи с логированием ошибки"""
+        task = asyncio.create_task(coro)
+        self._bg_tasks.add(task)
+        
+        def on_done(task: asyncio.Task) -> None:
+            self._bg_tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                logger.error(f"Background task failed ({description}): {task.exception()}")
+        
+        task.add_done_callback(on_done)
+    
+    async def aclose(self) -> None:
+        """Завершение фоновых задач, остановка отправителя и закрытие HTTP сессии"""
+        if self._bg_tasks:
+            await asyncio.gather(*self._bg_tasks, return_exceptions=True)
+        
+        if self._sender_task is not None:
+            self._sender_task.cancel()
+            self._sender_task = None
+        if self._send_tasks:
+            await asyncio.gather(*self._send_tasks, return_exceptions=True)
+        
+        # Сообщения, которые не успели уйти
+        while not self._send_queue.empty():
+            _, future = self._send_queue.get_nowait()
+            if not future.done():
+                future.set_result(False)
+        
+        if self.session and not self.session.closed:
             await self.session.close()
+        self.session = None
+        
+        await self.tnved_service.close()
+        if self.redis is not None:
+            await self.redis.aclose()
     
     async def initialize(self) -> None:
         """Инициализация бота"""
         try:
+            session = await self._get_session()
+            
             # Проверяем подключение к Telegram API
-            async with self.session.get(f"{self.base_url}/getMe") as response:
+            async with session.get(self._url_get_me) as response:
                 if response.status == 200:
-                    bot_info = await response.json()
+                    bot_info = orjson.loads(await response.read())
                     logger.info(f"Telegram bot initialized: @{bot_info['result']['username']}")
                 else:
                     raise Exception(f"Failed to initialize Telegram bot: {response.status}")
                     
+            # Запускаем фоновую отправку сообщений
+            if self._sender_task is None:
+                self._sender_task = asyncio.create_task(self._sender_loop())
+            
             # Инициализируем другие сервисы
             await self.airtable.initialize()
             await self.tnved_service.initialize()
@@ -69,89 +366,180 @@ class TelegramBotService:
             logger.error(f"Failed to initialize Telegram bot service: {e}")
             raise
     
-    async def send_message(self, chat_id: int, text: str, parse_mode: str = "HTML") -> bool:
-        """Отправка сообщения пользователю"""
+    async def _call_api(self, method: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Вызов метода Telegram Bot API с разбором ответа"""
+        session = await self._get_session()
+        async with session.post(self._api_url / method, json=data or {}) as response:
+            return orjson.loads(await response.read())
+    
+    async def set_webhook(self, url: str, secret_token: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Установка webhook вместо опроса getUpdates
+        
+        Telegram присылает только сообщения (ALLOWED_UPDATES), накопившиеся
+        обновления сбрасываются. secret_token Telegram передаёт в заголовке
+        X-Telegram-Bot-Api-Secret-Token каждого обновления.
+        """
+        data = {
+            "url": url,
+            "allowed_updates": self.ALLOWED_UPDATES,
+            "drop_pending_updates": True
+        }
+        if secret_token:
+            data["secret_token"] = secret_token
+        result = await self._call_api("setWebhook", data)
+        if result.get("ok"):
+            logger.info(f"Webhook set successfully: {url}")
+        else:
+            logger.error(f"Failed to set webhook: {result}")
+        return result
+    
+    async def delete_webhook(self) -> Dict[str, Any]:
+        """Удаление webhook"""
+        result = await self._call_api("deleteWebhook")
+        if result.get("ok"):
+            logger.info("Webhook deleted successfully")
+        else:
+            logger.error(f"Failed to delete webhook: {result}")
+        return result
+    
+    async def _sender_loop(self) -> None:
+        """
+        Фоновая отправка сообщений из очереди
+        
+        Сообщения отправляются сразу по мере поступления, но не более
+        MAX_CONCURRENT_SENDS одновременно: при всплеске нагрузки запросы
+        идут параллельно по пулу соединений, а не по одному.
+        """
+        while True:
+            data, future = await self._send_queue.get()
+            try:
+                await self._send_semaphore.acquire()
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.set_result(False)
+                raise
+            
+            task = asyncio.create_task(self._send_queued(data, future))
+            self._send_tasks.add(task)
+            task.add_done_callback(self._send_tasks.discard)
+    
+    async def _send_queued(self, data: Dict[str, Any], future: asyncio.Future) -> None:
+        """Отправка сообщения из очереди с передачей результата ожидающему"""
         try:
-            data = {
-                "chat_id": chat_id,
-                "text": text,
-                "parse_mode": parse_mode
-            }
-            
-            async with self.session.post(f"{self.base_url}/sendMessage", json=data) as response:
-                if response.status == 200:
-                    logger.info(f"Message sent to {chat_id}")
-                    return True
-                else:
-                    error_text = await response.text()
-                    logger.error(f"Failed to send message: {error_text}")
-                    return False
-                    
-        except Exception as e:
-            logger.error(f"Error sending message: {e}")
-            return False
+            result = await self._post_message(data)
+        finally:
+            self._send_semaphore.release()
+        
+        if not future.done():
+            future.set_result(result)
     
-    async def send_keyboard(self, chat_id: int, text: str, keyboard: list) -> bool:
-        """Отправка сообщения с клавиатурой"""
+    async def _post_message(self, data: Dict[str, Any]) -> bool:
+        """Запрос sendMessage к Telegram API"""
         try:
-            reply_markup = {
-                "keyboard": keyboard,
-                "resize_keyboard": True,
-                "one_time_keyboard": False
-            }
-            
-            data = {
-                "chat_id": chat_id,
-                "text": text,
-                "parse_mode": "HTML",
-                "reply_markup": reply_markup
-            }
-            
-            async with self.session.post(f"{self.base_url}/sendMessage", json=data) as response:
+            session = await self._get_session()
+            async with session.post(self._url_send_message, json=data) as response:
+                # Тело успешного ответа не читаем: соединение сразу возвращается в пул
                 if response.status == 200:
-                    logger.info(f"Keyboard message sent to {chat_id}")
+                    logger.debug("Message sent", chat_id=data["chat_id"])
                     return True
                 else:
-                    error_text = await response.text()
-                    logger.error(f"Failed to send keyboard message: {error_text}")
+                    error_body = await response.read()
+                    logger.error(f"Failed to send message: status={response.status} body={error_body[:200]!r}")
                     return False
                     
         except Exception as e:
-            logger.error(f"Error sending keyboard message: {e}")
+            logger.error(f"Error sending message: {e}")
             return False
     
+    async def _send(self, data: Dict[str, Any]) -> bool:
+        """Постановка сообщения в очередь отправки и ожидание результата"""
+        if self._sender_task is None:
+            # Отправитель не запущен (сервис не инициализирован) - отправляем напрямую
+            return await self._post_message(data)
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._send_queue.put((data, future))
+        return await future
+    
+    async def send_message(self, chat_id: int, text: str, parse_mode: str = "HTML") -> bool:
+        """Отправка сообщения пользователю"""
+        return await self._send({
+            "chat_id": chat_id,
+            "text": text,
+            "parse_mode": parse_mode
+        })
+    
+    async def send_keyboard(self, chat_id: int, text: str, keyboard: Union[list, orjson.Fragment]) -> bool:
+        """Отправка сообщения с клавиатурой (список кнопок или готовая разметка)"""
+        return await self._send({
+            "chat_id": chat_id,
+            "text": text,
+            "parse_mode": "HTML",
+            "reply_markup": keyboard if isinstance(keyboard, orjson.Fragment) else _reply_markup(keyboard)
+        })
+    
+    async def _get_state(self, chat_id: int) -> Dict[str, Any]:
+        """Получение состояния пользователя"""
+        if self.redis is None:
+            return self._states.get(chat_id, {})
+        
+        raw = await self.redis.get(f"bot:state:{chat_id}")
+        return orjson.loads(raw) if raw else {}
+    
+    async def _set_state(self, chat_id: int, state: str, data: Optional[Dict[str, Any]] = None) -> None:
+        """Сохранение состояния пользователя"""
+        if self.redis is None:
+            self._states.set(chat_id, {"state": state, "data": data or {}})
+            return
+        
+        await self.redis.setex(
+            f"bot:state:{chat_id}",
+            self.USER_STATE_TTL,
+            orjson.dumps({"state": state, "data": data or {}})
+        )
+    
+    async def get_tariffs(self, use_cache: bool = True) -> list:
+        """Получение тарифов из Airtable (с кэшированием)"""
+        if use_cache:
+            tariffs = self._tariffs_cache.get("tariffs")
+            if tariffs is not None:
+                return tariffs
+        
+        tariffs = await self.airtable.get_tariffs()
+        self._tariffs_cache.set("tariffs", tariffs)
+        return tariffs
+    
+    async def search_tnved_codes(self, description: str, use_cache: bool = True) -> Dict[str, Any]:
+        """Поиск ТН ВЭД кодов по описанию (с кэшированием успешных результатов)"""
+        key = description.lower().strip()
+        if use_cache:
+            result = self._tnved_cache.get(key)
+            if result is not None:
+                return result
+        
+        result = await self.tnved_service.search_tnved_codes(description)
+        if result.get("success"):
+            self._tnved_cache.set(key, result)
+        return result
+    
     def get_main_keyboard(self) -> list:
         """Главная клавиатура бота"""
-        return [
-            ["📦 Расчет доставки", "🔍 Поиск ТН ВЭД"],
-            ["🏢 Проверка поставщика", "📊 Мои расчеты"],
-            ["ℹ️ Помощь", "📞 Связаться с менеджером"]
-        ]
+        return MAIN_KEYBOARD
     
     def get_calculation_keyboard(self) -> list:
         """Клавиатура для расчета доставки"""
-        return [
-            ["🔙 Назад", "📋 Пример расчета"],
-            ["❓ Как пользоваться"]
-        ]
+        return CALCULATION_KEYBOARD
     
     async def handle_start_command(self, chat_id: int, user_info: Dict[str, Any]) -> None:
         """Обработка команды /start"""
-        welcome_text = f"""
-🤖 <b>Добро пожаловать в AI Logistics Hub!</b>
-
-Я помогу вам рассчитать стоимость доставки из Китая в Казахстан, найти ТН ВЭД коды и проверить поставщиков.
-
-<b>Что я умею:</b>
-• 📦 Расчет стоимости карго и белой доставки
-• 🔍 Поиск и классификация ТН ВЭД кодов
-• 🏢 Проверка китайских поставщиков
-• 📊 История ваших расчетов
-
-Выберите нужную опцию:
-        """
+        # Сохраняем пользователя в Airtable в фоне, не задерживая приветствие
+        self._spawn_bg(self._register_user(chat_id, user_info), "register user")
         
-        # Сохраняем пользователя в Airtable
+        await self.send_keyboard(chat_id, _WELCOME_TEXT, _MAIN_MARKUP)
+    
+    async def _register_user(self, chat_id: int, user_info: Dict[str, Any]) -> None:
+        """Сохранение пользователя в Airtable"""
         try:
             client_data = {
                 "name": user_info.get("first_name", ""),
@@ -163,113 +551,53 @@ class TelegramBotService:
             }
             
             await self.airtable.save_client(client_data)
-            logger.info(f"New user registered: {chat_id}")
+            logger.debug("New user registered", chat_id=chat_id)
             
         except Exception as e:
             logger.error(f"Failed to save user to Airtable: {e}")
-        
-        await self.send_keyboard(chat_id, welcome_text, self.get_main_keyboard())
     
     async def handle_calculation_request(self, chat_id: int) -> None:
         """Обработка запроса на расчет доставки"""
         # Устанавливаем состояние пользователя
-        self.user_states[chat_id] = {
-            "state": "waiting_calculation_data",
-            "data": {}
-        }
+        await self._set_state(chat_id, "waiting_calculation_data")
         
-        instruction_text = """
-📦 <b>Расчет стоимости доставки</b>
-
-Для расчета мне нужна следующая информация:
-
-<b>1. Вес груза (кг)</b>
-<b>2. Объем груза (м³)</b>
-<b>3. Город отправления</b>
-<b>4. Город назначения</b>
-<b>5. Описание товара</b>
-
-Отправьте данные в формате:
-<code>
-Вес: 100
-Объем: 0.5
-Откуда: Shenzhen
-Куда: Almaty
-Товар: LED лампы, 10W, E27
-</code>
-
-Или нажмите "📋 Пример расчета" для демонстрации.
-        """
-        
-        await self.send_keyboard(chat_id, instruction_text, self.get_calculation_keyboard())
+        await self.send_keyboard(chat_id, _INSTRUCTION_CALCULATION, _CALCULATION_MARKUP)
     
     async def handle_tnved_search(self, chat_id: int) -> None:
         """Обработка запроса на поиск ТН ВЭД"""
-        self.user_states[chat_id] = {
-            "state": "waiting_tnved_query",
-            "data": {}
-        }
+        await self._set_state(chat_id, "waiting_tnved_query")
         
-        instruction_text = """
-🔍 <b>Поиск ТН ВЭД кода</b>
-
-Опишите ваш товар максимально подробно, и я найду подходящий ТН ВЭД код.
-
-<b>Примеры запросов:</b>
-• LED лампы светодиодные 10W E27 цоколь
-• Одежда детская хлопковая футболки
-• Электроника смартфоны мобильные телефоны
-
-Отправьте описание товара:
-        """
-        
-        keyboard = [["🔙 Назад"]]
-        await self.send_keyboard(chat_id, instruction_text, keyboard)
+        await self.send_keyboard(chat_id, _INSTRUCTION_TNVED, _BACK_MARKUP)
     
     async def handle_supplier_check(self, chat_id: int) -> None:
         """Обработка запроса на проверку поставщика"""
-        self.user_states[chat_id] = {
-            "state": "waiting_supplier_info",
-            "data": {}
-        }
+        await self._set_state(chat_id, "waiting_supplier_info")
         
-        instruction_text = """
-🏢 <b>Проверка китайского поставщика</b>
-
-Для проверки поставщика мне нужна следующая информация:
-
-<b>1. Название компании</b>
-<b>2. Регистрационный номер (если есть)</b>
-
-Отправьте данные в формате:
-<code>
-Компания: Shenzhen Electronics Co., Ltd.
-Рег. номер: 91440300XXXXXXXXXX
-</code>
-
-Или просто название компании, если номер неизвестен.
-        """
-        
-        keyboard = [["🔙 Назад"]]
-        await self.send_keyboard(chat_id, instruction_text, keyboard)
+        await self.send_keyboard(chat_id, _INSTRUCTION_SUPPLIER, _BACK_MARKUP)
     
     async def handle_calculation_history(self, chat_id: int) -> None:
         """Показать историю расчетов пользователя"""
         try:
             # Получаем историю расчетов из Airtable
-            calculations = await self.airtable.get_user_calculation_history(str(chat_id))
+            # Последние 5 расчетов, только поля, которые показываем
+            calculations = await self.airtable.get_user_calculation_history(
+                str(chat_id),
+                limit=5,
+                fields=["Origin", "Destination", "Weight", "CargoCost"]
+            )
             
             if not calculations:
                 await self.send_message(chat_id, "📊 У вас пока нет сохраненных расчетов.")
                 return
             
-            history_text = "📊 <b>Ваши последние расчеты:</b>\n\n"
-            
-            for i, calc in enumerate(calculations[:5], 1):  # Показываем последние 5
-                history_text += f"<b>{i}.</b> {calc.get('Origin', 'N/A')} → {calc.get('Destination', 'N/A')}\n"
-                history_text += f"Вес: {calc.get('Weight', 'N/A')} кг | Стоимость: ${calc.get('CargoCost', 'N/A')}\n\n"
+            parts = ["📊 <b>Ваши последние расчеты:</b>\n\n"]
+            parts.extend(
+                f"<b>{i}.</b> {calc.get('Origin', 'N/A')} → {calc.get('Destination', 'N/A')}\n"
+                f"Вес: {calc.get('Weight', 'N/A')} кг | Стоимость: ${calc.get('CargoCost', 'N/A')}\n\n"
+                for i, calc in enumerate(calculations, 1)
+            )
             
-            await self.send_message(chat_id, history_text)
+            await self.send_message(chat_id, "".join(parts))
             
         except Exception as e:
             logger.error(f"Failed to get calculation history: {e}")
@@ -277,42 +605,32 @@ class TelegramBotService:
     
     async def handle_help(self, chat_id: int) -> None:
         """Показать справку"""
-        help_text = """
-ℹ️ <b>Справка по использованию бота</b>
-
-<b>📦 Расчет доставки</b>
-• Укажите вес, объем, города и описание товара
-• Получите расчет для карго и белой доставки
-• Сравните варианты и выберите оптимальный
-
-<b>🔍 Поиск ТН ВЭД</b>
-• Опишите товар подробно
-• Получите точный ТН ВЭД код
-• Узнайте ставки пошлин и требования
-
-<b>🏢 Проверка поставщика</b>
-• Укажите название китайской компании
-• Получите отчет о надежности
-• Узнайте риски и рекомендации
-
-<b>📞 Поддержка</b>
-По всем вопросам обращайтесь к менеджеру:
-• Telegram: @manager_username
-• Email: support@ailogistics.kz
-• Телефон: +7 XXX XXX XX XX
-        """
-        
-        await self.send_message(chat_id, help_text)
+        await self.send_message(chat_id, _HELP_TEXT)
     
     async def process_message(self, message: Dict[str, Any]) -> None:
-        """Основной обработчик сообщений"""
+        """Основной обработчик сообщений (последовательно для каждого чата)"""
+        chat_id = message["chat"]["id"]
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        self._chat_waiters[chat_id] = self._chat_waiters.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                await self._process_message(message)
+        finally:
+            # Удаляем блокировку, когда сообщений этого чата больше нет
+            self._chat_waiters[chat_id] -= 1
+            if not self._chat_waiters[chat_id]:
+                del self._chat_waiters[chat_id]
+                del self._chat_locks[chat_id]
+    
+    async def _process_message(self, message: Dict[str, Any]) -> None:
+        """Обработка сообщения в зависимости от состояния пользователя"""
         try:
             chat_id = message["chat"]["id"]
             user_info = message["from"]
             text = message.get("text", "").strip()
             
             # Получаем текущее состояние пользователя
-            user_state = self.user_states.get(chat_id, {})
+            user_state = await self._get_state(chat_id)
             current_state = user_state.get("state", "main_menu")
             
             # Обработка команд
@@ -324,14 +642,9 @@ class TelegramBotService:
                 return
             
             # Обработка по состоянию
-            if current_state == "main_menu":
-                await self.handle_main_menu(chat_id, text)
-            elif current_state == "waiting_calculation_data":
-                await self.handle_calculation_data(chat_id, text)
-            elif current_state == "waiting_tnved_query":
-                await self.handle_tnved_query(chat_id, text)
-            elif current_state == "waiting_supplier_info":
-                await self.handle_supplier_info(chat_id, text)
+            handler = _STATE_HANDLERS.get(current_state)
+            if handler:
+                await getattr(self, handler)(chat_id, text)
                 
         except Exception as e:
             logger.error(f"Error processing message: {e}")
@@ -339,70 +652,35 @@ class TelegramBotService:
     
     async def handle_main_menu(self, chat_id: int, text: str) -> None:
         """Обработка главного меню"""
-        if text == "📦 Расчет доставки":
-            await self.handle_calculation_request(chat_id)
-        elif text == "🔍 Поиск ТН ВЭД":
-            await self.handle_tnved_search(chat_id)
-        elif text == "🏢 Проверка поставщика":
-            await self.handle_supplier_check(chat_id)
-        elif text == "📊 Мои расчеты":
-            await self.handle_calculation_history(chat_id)
-        elif text == "ℹ️ Помощь":
-            await self.handle_help(chat_id)
-        elif text == "📞 Связаться с менеджером":
-            await self.send_message(chat_id, "📞 Свяжитесь с менеджером:\nTelegram: @manager_username\nEmail: support@ailogistics.kz")
-        elif text == "🔙 Назад":
-            # Возвращаемся в главное меню
-            self.user_states[chat_id] = {"state": "main_menu", "data": {}}
-            await self.send_keyboard(chat_id, "🏠 Главное меню:", self.get_main_keyboard())
+        handler = _MAIN_MENU_HANDLERS.get(text)
+        if handler:
+            await getattr(self, handler)(chat_id)
         else:
             await self.send_message(chat_id, "Выберите опцию из меню ниже:")
     
+    async def handle_contact_manager(self, chat_id: int) -> None:
+        """Контакты менеджера"""
+        await self.send_message(chat_id, "📞 Свяжитесь с менеджером:\nTelegram: @manager_username\nEmail: support@ailogistics.kz")
+    
+    async def handle_back_to_main_menu(self, chat_id: int) -> None:
+        """Возврат в главное меню"""
+        await self._set_state(chat_id, "main_menu")
+        await self.send_keyboard(chat_id, "🏠 Главное меню:", _MAIN_MARKUP)
+    
     async def handle_calculation_data(self, chat_id: int, text: str) -> None:
         """Обработка данных для расчета"""
         if text == "📋 Пример расчета":
-            example_text = """
-📋 <b>Пример расчета доставки</b>
-
-Отправьте данные в таком формате:
-
-<code>
-Вес: 100
-Объем: 0.5
-Откуда: Shenzhen
-Куда: Almaty
-Товар: LED лампы светодиодные 10W E27 цоколь белый свет
-</code>
-
-После отправки я рассчитаю стоимость карго и белой доставки.
-            """
-            await self.send_message(chat_id, example_text)
+            await self.send_message(chat_id, _CALCULATION_EXAMPLE_TEXT)
             return
         
         if text == "❓ Как пользоваться":
-            help_text = """
-❓ <b>Как пользоваться расчетом</b>
-
-1. <b>Вес груза</b> - укажите в килограммах
-2. <b>Объем груза</b> - укажите в кубических метрах
-3. <b>Город отправления</b> - обычно Shenzhen, Guangzhou, Shanghai
-4. <b>Город назначения</b> - ваш город в Казахстане
-5. <b>Описание товара</b> - подробное описание для определения ТН ВЭД
-
-<b>Пример:</b>
-Вес: 50
-Объем: 0.3
-Откуда: Shenzhen
-Куда: Almaty
-Товар: Электронные компоненты, микросхемы, резисторы
-            """
-            await self.send_message(chat_id, help_text)
+            await self.send_message(chat_id, _CALCULATION_HOWTO_TEXT)
             return
         
         # Парсим данные для расчета
         try:
             calculation_data = self.parse_calculation_text(text)
-            if calculation_data:
+            if calculation_data is not None:
                 await self.perform_calculation(chat_id, calculation_data)
             else:
                 await self.send_message(chat_id, "❌ Не удалось распознать данные. Используйте формат из примера.")
@@ -410,65 +688,42 @@ class TelegramBotService:
             logger.error(f"Error parsing calculation data: {e}")
             await self.send_message(chat_id, "❌ Ошибка при обработке данных. Попробуйте еще раз.")
     
-    def parse_calculation_text(self, text: str) -> Optional[Dict[str, Any]]:
-        """Парсинг текста с данными для расчета"""
+    def parse_calculation_text(self, text: str) -> Optional[BotCalculationInput]:
+        """Парсинг и валидация текста с данными для расчета"""
+        data = {
+            _CALCULATION_FIELDS[match.group("key").lower()]: match.group("value")
+            for match in _CALCULATION_LINE_RE.finditer(text)
+        }
+        
+        # Проверяем наличие всех необходимых полей и приводим числа
         try:
-            lines = text.split('\n')
-            data = {}
-            
-            for line in lines:
-                line = line.strip()
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    key = key.strip().lower()
-                    value = value.strip()
-                    
-                    if 'вес' in key:
-                        data['weight'] = float(value)
-                    elif 'объем' in key:
-                        data['volume'] = float(value)
-                    elif 'откуда' in key or 'отправление' in key:
-                        data['origin'] = value
-                    elif 'куда' in key or 'назначение' in key:
-                        data['destination'] = value
-                    elif 'товар' in key or 'описание' in key:
-                        data['description'] = value
-            
-            # Проверяем наличие всех необходимых полей
-            required_fields = ['weight', 'volume', 'origin', 'destination', 'description']
-            if all(field in data for field in required_fields):
-                return data
-            
-            return None
-            
-        except Exception as e:
+            return BotCalculationInput.model_validate(data)
+        except ValidationError as e:
             logger.error(f"Error parsing calculation text: {e}")
             return None
     
-    async def perform_calculation(self, chat_id: int, data: Dict[str, Any]) -> None:
+    async def perform_calculation(self, chat_id: int, data: BotCalculationInput) -> None:
         """Выполнение расчета доставки"""
         try:
-            # Отправляем сообщение о начале расчета
-            await self.send_message(chat_id, "🔄 Выполняю расчет...")
-            
-            # Получаем ТН ВЭД код
-            tnved_result = await self.tnved_service.search_tnved_codes(data['description'])
-            
-            # Получаем тарифы из Airtable
-            tariffs = await self.airtable.get_tariffs()
+            # Сообщение о начале расчета и поиск ТН ВЭД кода независимы.
+            # При ошибке одного запроса группа отменяет другой, а не оставляет его висеть
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(self.send_message(chat_id, "🔄 Выполняю расчет..."))
+                tnved_task = tg.create_task(self.search_tnved_codes(data.description))
+            tnved_result = tnved_task.result()
             
             # Выполняем расчет (упрощенная версия)
-            cargo_cost = data['weight'] * 2.5  # Примерная стоимость карго
-            white_cost = data['weight'] * 4.0   # Примерная стоимость белой доставки
+            cargo_cost = data.weight * 2.5  # Примерная стоимость карго
+            white_cost = data.weight * 4.0   # Примерная стоимость белой доставки
             
             # Формируем результат
             result_text = f"""
 📦 <b>Результат расчета доставки</b>
 
-<b>Маршрут:</b> {data['origin']} → {data['destination']}
-<b>Вес:</b> {data['weight']} кг
-<b>Объем:</b> {data['volume']} м³
-<b>Товар:</b> {data['description']}
+<b>Маршрут:</b> {data.origin} → {data.destination}
+<b>Вес:</b> {data.weight} кг
+<b>Объем:</b> {data.volume} м³
+<b>Товар:</b> {data.description}
 
 <b>ТН ВЭД код:</b> {tnved_result.get('code', 'Не определен')}
 
@@ -488,41 +743,42 @@ class TelegramBotService:
             
             # Сохраняем расчет в Airtable
             calculation_data = {
-                "request_id": f"calc_{chat_id}_{int(datetime.now().timestamp())}",
-                "weight": data['weight'],
-                "volume": data['volume'],
-                "origin": data['origin'],
-                "destination": data['destination'],
+                "request_id": f"calc_{chat_id}_{time.time_ns()}",
+                "weight": data.weight,
+                "volume": data.volume,
+                "origin": data.origin,
+                "destination": data.destination,
                 "cargo_cost": cargo_cost,
                 "white_cost": white_cost,
                 "tnved_code": tnved_result.get('code', ''),
-                "description": data['description']
+                "description": data.description
             }
             
-            await self.airtable.save_calculation(calculation_data)
+            # Сохраняем в фоне - пользователю не нужно ждать записи
+            self._spawn_bg(self.airtable.save_calculation(calculation_data), "save calculation")
             
             # Возвращаемся в главное меню
-            self.user_states[chat_id] = {"state": "main_menu", "data": {}}
+            await self._set_state(chat_id, "main_menu")
             
-            keyboard = [["📦 Новый расчет", "📊 Мои расчеты"], ["🔙 Главное меню"]]
-            await self.send_keyboard(chat_id, result_text, keyboard)
+            await self.send_keyboard(chat_id, result_text, _CALCULATION_RESULT_MARKUP)
             
-        except Exception as e:
-            logger.error(f"Error performing calculation: {e}")
+        except* Exception as eg:
+            for e in eg.exceptions:
+                logger.error(f"Error performing calculation: {e!r}")
             await self.send_message(chat_id, "❌ Ошибка при выполнении расчета. Попробуйте позже.")
     
     async def handle_tnved_query(self, chat_id: int, text: str) -> None:
         """Обработка запроса ТН ВЭД"""
         if text == "🔙 Назад":
-            self.user_states[chat_id] = {"state": "main_menu", "data": {}}
-            await self.send_keyboard(chat_id, "🏠 Главное меню:", self.get_main_keyboard())
+            await self._set_state(chat_id, "main_menu")
+            await self.send_keyboard(chat_id, "🏠 Главное меню:", _MAIN_MARKUP)
             return
         
         try:
             await self.send_message(chat_id, "🔍 Ищу ТН ВЭД код...")
             
             # Выполняем поиск ТН ВЭД
-            result = await self.tnved_service.search_tnved_codes(text)
+            result = await self.search_tnved_codes(text)
             
             if result and result.get('results'):
                 tnved_info = result['results'][0]
@@ -553,11 +809,10 @@ class TelegramBotService:
 • Обратиться к менеджеру для помощи
                 """
             
-            keyboard = [["🔍 Новый поиск"], ["🔙 Главное меню"]]
-            await self.send_keyboard(chat_id, response_text, keyboard)
+            await self.send_keyboard(chat_id, response_text, _TNVED_RESULT_MARKUP)
             
             # Возвращаемся в главное меню
-            self.user_states[chat_id] = {"state": "main_menu", "data": {}}
+            await self._set_state(chat_id, "main_menu")
             
         except Exception as e:
             logger.error(f"Error searching TNVED: {e}")
@@ -566,8 +821,8 @@ class TelegramBotService:
     async def handle_supplier_info(self, chat_id: int, text: str) -> None:
         """Обработка информации о поставщике"""
         if text == "🔙 Назад":
-            self.user_states[chat_id] = {"state": "main_menu", "data": {}}
-            await self.send_keyboard(chat_id, "🏠 Главное меню:", self.get_main_keyboard())
+            await self._set_state(chat_id, "main_menu")
+            await self.send_keyboard(chat_id, "🏠 Главное меню:", _MAIN_MARKUP)
             return
         
         try:
@@ -596,11 +851,10 @@ class TelegramBotService:
 Это предварительная оценка. Для полной проверки обратитесь к менеджеру.
             """
             
-            keyboard = [["🏢 Проверить другого"], ["🔙 Главное меню"]]
-            await self.send_keyboard(chat_id, response_text, keyboard)
+            await self.send_keyboard(chat_id, response_text, _SUPPLIER_RESULT_MARKUP)
             
             # Возвращаемся в главное меню
-            self.user_states[chat_id] = {"state": "main_menu", "data": {}}
+            await self._set_state(chat_id, "main_menu")
             
         except Exception as e:
             logger.error(f"Error checking supplier: {e}")
@@ -608,11 +862,43 @@ class TelegramBotService:
 
 
 # Функция для получения экземпляра сервиса
+# Глобальный экземпляр сервиса: одна сессия, очередь отправки и кэши на всё приложение
+_service: Optional[TelegramBotService] = None
+_service_lock = asyncio.Lock()
+
+
 async def get_telegram_bot_service() -> TelegramBotService:
-    """Получение экземпляра Telegram Bot сервиса"""
+    """
+    Получение экземпляра Telegram Bot сервиса
+    
+    Сервис рассчитан на работу в цикле uvloop (приложение запускается
+    с loop="auto" - uvloop, где он установлен): много мелких HTTP запросов
+    и очередь отправки.
+    """
+    global _service
+    
+    if _service is not None:
+        return _service
+    
     if not settings.TELEGRAM_BOT_TOKEN:
         raise ValueError("TELEGRAM_BOT_TOKEN not configured")
     
-    service = TelegramBotService(settings.TELEGRAM_BOT_TOKEN)
-    await service.initialize()
-    return service
+    async with _service_lock:
+        if _service is None:
+            service = TelegramBotService(settings.TELEGRAM_BOT_TOKEN)
+            try:
+                await service.initialize()
+            except Exception:
+                await service.aclose()
+                raise
+            _service = service
+    return _service
+
+
+async def close_telegram_bot_service() -> None:
+    """Закрытие экземпляра Telegram Bot сервиса при остановке приложения"""
+    global _service
+    
+    if _service is not None:
+        await _service.aclose()
+        _service = None
@@ -3,23 +3,109 @@
 Лицензия ТНВЭД API также действует и на сайте tnved.info
 """
 
-import base64
 import asyncio
+import base64
+import time
+from collections import deque
 from datetime import datetime
-from typing import List, Optional, Dict, Any
-from decimal import Decimal
+from typing import Any, Deque, Dict, Optional, Tuple
 
-import aiohttp
+import httpx
+import orjson
 import structlog
 
+from app.core.config import settings
+from app.core.retry import MAX_RETRY_DELAY, retry_delay
 from app.models.schemas import TNVEDInfo, CargoCategory
+from app.services.tnved_base import (
+    DEFAULT_DUTY_RATE,
+    DEFAULT_VAT_RATE,
+    BaseTNVEDService,
+    get_tnved_client
+)
 
 logger = structlog.get_logger(__name__)
 
+class _AdaptiveLimiter:
+    """
+    Ограничение параллельных запросов по схеме AIMD с circuit breaker
+    
+    Лимит растёт на 0.5 после быстрого успешного ответа и уменьшается вдвое
+    при перегрузке API (429/449/5xx, таймаут). После BREAKER_THRESHOLD ошибок
+    подряд запросы отклоняются сразу в течение BREAKER_OPEN_SECONDS.
+    """
+    
+    MIN_CONCURRENCY = 1
+    MAX_CONCURRENCY = 32
+    TARGET_LATENCY = 1.0
+    BREAKER_THRESHOLD = 5
+    BREAKER_OPEN_SECONDS = 30.0
+    
+    def __init__(self, initial: float = 8):
+        self.concurrency = float(initial)
+        self._active = 0
+        self._condition = asyncio.Condition()
+        self._latencies: Deque[float] = deque(maxlen=20)
+        self._failures = 0
+        self._open_until = 0.0
+    
+    def check(self) -> None:
+        """Отклонение запроса, пока circuit breaker открыт"""
+        if self._open_until > time.monotonic():
+            raise Exception("TNVED API circuit breaker is open. Please try again later.")
+    
+    async def acquire(self) -> None:
+        """Ожидание свободного слота в пределах текущего лимита"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._active < int(self.concurrency))
+            self._active += 1
+    
+    async def release(self) -> None:
+        """Освобождение слота"""
+        self._active -= 1
+        async with self._condition:
+            self._condition.notify_all()
+    
+    def open(self, seconds: float) -> None:
+        """Принудительное открытие circuit breaker"""
+        self._open_until = max(self._open_until, time.monotonic() + seconds)
+    
+    def on_success(self, latency: float) -> None:
+        """Учёт успешного ответа: аддитивное увеличение лимита"""
+        self._failures = 0
+        self._latencies.append(latency)
+        if sum(self._latencies) / len(self._latencies) <= self.TARGET_LATENCY:
+            self.concurrency = min(self.MAX_CONCURRENCY, self.concurrency + 0.5)
+    
+    def on_overload(self) -> None:
+        """Учёт перегрузки API: мультипликативное уменьшение лимита"""
+        self.concurrency = max(self.MIN_CONCURRENCY, self.concurrency * 0.5)
+        self._failures += 1
+        if self._failures >= self.BREAKER_THRESHOLD:
+            self.open(self.BREAKER_OPEN_SECONDS)
+            self._failures = 0
+            logger.warning("TNVED API circuit breaker opened", open_seconds=self.BREAKER_OPEN_SECONDS)
+
 
-class TNVEDInfoService:
+class TNVEDInfoService(BaseTNVEDService):
     """Сервис для работы с API tnved.info"""
     
+    # Статусы, означающие перегрузку API (запрос повторяется до MAX_ATTEMPTS раз)
+    _OVERLOAD_STATUSES = frozenset({429, 449, 500, 502, 503, 504})
+    MAX_ATTEMPTS = 4
+    RETRY_BASE_DELAY = 1.0
+    
+    # Остаток лицензии, ниже которого запросы идут не чаще раза в low_quota_interval секунд
+    # (settings.TNVED_LOW_QUOTA_INTERVAL)
+    LICENSE_RESERVE = 10
+    
+    
+    # Пауза после ответа "лицензия истекла" (секунды)
+    LICENSE_EXPIRED_COOLDOWN = 600.0
+    
+    # Время, в течение которого результат проверки работоспособности считается актуальным
+    HEALTH_CHECK_TTL = 60.0
+    
     def __init__(self, username: str, password: str):
         """
         Инициализация сервиса
@@ -36,8 +122,24 @@ class TNVEDInfoService:
         # Создаём Basic authentication header
         self.auth_header = self._create_auth_header()
         
-        # Кэш для часто используемых кодов
-        self._cache = {}
+        super().__init__(headers={"Authorization": self.auth_header})
+        
+        # Адаптивный лимит параллельных запросов и circuit breaker
+        self._limiter = _AdaptiveLimiter()
+        
+        # Остаток лицензии из последнего ответа и время, раньше которого
+        # нельзя отправлять следующий запрос (Retry-After, экономия квоты)
+        self._license_remain: Optional[int] = None
+        self._next_request_at = 0.0
+        
+        # Интервал запросов при почти исчерпанной квоте и максимальное ожидание
+        # очереди (квота, Retry-After); дольше - отказ сразу, обработчик API не висит
+        self.low_quota_interval = float(settings.TNVED_LOW_QUOTA_INTERVAL)
+        self.max_quota_wait = float(settings.TNVED_MAX_QUOTA_WAIT)
+        
+        # Информация о лицензии из последнего поиска и результат последней проверки API
+        self._license_info: Optional[Dict[str, Any]] = None
+        self._health: Optional[Tuple[float, bool]] = None
         
         logger.info("TNVED Info service initialized", username=username)
     
@@ -47,6 +149,63 @@ class TNVEDInfoService:
         encoded_credentials = base64.b64encode(credentials.encode('utf-8')).decode('utf-8')
         return f"Basic {encoded_credentials}"
     
+    async def _wait_for_quota(self) -> None:
+        """Ожидание разрешённого времени запроса с учётом квоты лицензии и Retry-After"""
+        now = time.monotonic()
+        start_at = max(self._next_request_at, now)
+        
+        # Не держим обработчик запроса в очереди дольше max_quota_wait
+        if start_at - now > self.max_quota_wait:
+            logger.warning(f"TNVED API request rejected: queue wait {start_at - now:.0f}s")
+            raise Exception("TNVED API is rate limited or license quota nearly exhausted. Try again later.")
+        
+        if self._license_remain is not None and self._license_remain < self.LICENSE_RESERVE:
+            # Квота почти исчерпана - растягиваем остаток, а не сжигаем его в 403
+            self._next_request_at = start_at + self.low_quota_interval
+        
+        if start_at > now:
+            await asyncio.sleep(start_at - now)
+    
+    def _defer_requests(self, response: httpx.Response) -> None:
+        """Откладывание следующих запросов по заголовку Retry-After (не больше MAX_RETRY_DELAY)"""
+        retry_after = response.headers.get("Retry-After")
+        if not retry_after:
+            return
+        delay = retry_delay(0, retry_after, max_delay=MAX_RETRY_DELAY)
+        self._next_request_at = max(self._next_request_at, time.monotonic() + delay)
+    
+    @staticmethod
+    def _body_text(response: httpx.Response) -> str:
+        """Тело ответа как текст (для логов)"""
+        return response.content.decode("utf-8", errors="replace")
+    
+    async def _send_limited(
+        self,
+        url: str,
+        params: Optional[Dict[str, Any]],
+        timeout: float
+    ) -> httpx.Response:
+        """Одна попытка запроса с учётом квоты, адаптивного лимита и circuit breaker"""
+        self._limiter.check()
+        await self._wait_for_quota()
+        await self._limiter.acquire()
+        try:
+            started = time.monotonic()
+            response = await self._send(url, params, timeout=timeout)
+        except httpx.TransportError:
+            self._limiter.on_overload()
+            raise
+        finally:
+            await self._limiter.release()
+        
+        if response.status_code in self._OVERLOAD_STATUSES:
+            self._limiter.on_overload()
+            self._defer_requests(response)
+        elif response.status_code < 400:
+            self._limiter.on_success(time.monotonic() - started)
+        
+        return response
+    
     async def _make_request(
         self, 
         url: str, 
@@ -55,59 +214,69 @@ class TNVEDInfoService:
     ) -> Dict[str, Any]:
         """Выполнение HTTP запроса к API tnved.info"""
         
-        headers = {
-            "Content-Type": "application/json; charset=utf-8",
-            "Authorization": self.auth_header,
-            "User-Agent": "AI-Logistics-Hub/1.0"
-        }
-        
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    url,
-                    headers=headers,
-                    params=params,
-                    timeout=timeout
-                ) as response:
-                    
-                    response_text = await response.text()
-                    
-                    if response.status == 200:
-                        try:
-                            return await response.json()
-                        except Exception as e:
-                            logger.error(f"Failed to parse JSON response: {e}")
-                            raise Exception(f"Invalid JSON response: {response_text}")
-                    
-                    elif response.status == 401:
-                        logger.error("Unauthorized access to TNVED API")
-                        raise Exception("Unauthorized access to TNVED API. Check username and password.")
-                    
-                    elif response.status == 403:
-                        logger.error("TNVED API license expired")
-                        raise Exception("TNVED API license expired. Please renew your license.")
-                    
-                    elif response.status == 203:
-                        logger.info("No results found for the query")
-                        return {"Result": [], "ResponseState": 203}
-                    
-                    elif response.status == 301:
-                        logger.warning("Incomplete TNVED code provided")
-                        return {"Result": [], "ResponseState": 301, "ErrorMessage": "Incomplete TNVED code"}
-                    
-                    elif response.status == 449:
-                        logger.warning("TNVED API is updating. Please try again later.")
-                        raise Exception("TNVED API is updating. Please try again in a few seconds.")
-                    
-                    elif response.status == 500:
-                        logger.error("TNVED API internal server error")
-                        raise Exception("TNVED API internal server error")
-                    
-                    else:
-                        logger.error(f"TNVED API error: {response.status} - {response_text}")
-                        raise Exception(f"TNVED API error: {response.status}")
-                        
-        except asyncio.TimeoutError:
+            for attempt in range(self.MAX_ATTEMPTS):
+                last_attempt = attempt + 1 == self.MAX_ATTEMPTS
+                try:
+                    response = await self._send_limited(url, params, timeout)
+                except httpx.TransportError as e:
+                    # Таймауты и сетевые ошибки
+                    if last_attempt:
+                        raise
+                    delay = retry_delay(attempt, base=self.RETRY_BASE_DELAY)
+                    logger.warning(
+                        f"TNVED API request error: {e!r}, retrying in {delay:.2f}s "
+                        f"(attempt {attempt + 1}/{self.MAX_ATTEMPTS})"
+                    )
+                else:
+                    if response.status_code not in self._OVERLOAD_STATUSES or last_attempt:
+                        break
+                    delay = retry_delay(attempt, response.headers.get("Retry-After"), base=self.RETRY_BASE_DELAY)
+                    logger.warning(
+                        f"TNVED API error: {response.status_code}, retrying in {delay:.2f}s "
+                        f"(attempt {attempt + 1}/{self.MAX_ATTEMPTS})"
+                    )
+                
+                await asyncio.sleep(delay)
+            
+            # Тело декодируется в текст только для сообщений об ошибках
+            if response.status_code == 200:
+                try:
+                    return orjson.loads(response.content)
+                except orjson.JSONDecodeError as e:
+                    logger.error(f"Failed to parse JSON response: {e}")
+                    raise Exception(f"Invalid JSON response: {self._body_text(response)}")
+            
+            elif response.status_code == 401:
+                logger.error("Unauthorized access to TNVED API")
+                raise Exception("Unauthorized access to TNVED API. Check username and password.")
+            
+            elif response.status_code == 403:
+                logger.error("TNVED API license expired")
+                self._limiter.open(self.LICENSE_EXPIRED_COOLDOWN)
+                raise Exception("TNVED API license expired. Please renew your license.")
+            
+            elif response.status_code == 203:
+                logger.info("No results found for the query")
+                return {"Result": [], "ResponseState": 203}
+            
+            elif response.status_code == 301:
+                logger.warning("Incomplete TNVED code provided")
+                return {"Result": [], "ResponseState": 301, "ErrorMessage": "Incomplete TNVED code"}
+            
+            elif response.status_code == 449:
+                logger.warning("TNVED API is updating. Please try again later.")
+                raise Exception("TNVED API is updating. Please try again in a few seconds.")
+            
+            elif response.status_code == 500:
+                logger.error("TNVED API internal server error")
+                raise Exception("TNVED API internal server error")
+            
+            else:
+                logger.error(f"TNVED API error: {response.status_code} - {self._body_text(response)}")
+                raise Exception(f"TNVED API error: {response.status_code}")
+                
+        except httpx.TimeoutException:
             logger.error("TNVED API request timeout")
             raise Exception("TNVED API request timeout")
         except Exception as e:
@@ -132,13 +301,10 @@ class TNVEDInfoService:
             Словарь с результатами поиска
         """
         
+        log = logger.bind(request_id=request_id)
+        
         try:
-            logger.info(
-                "Searching TNVED codes",
-                request_id=request_id,
-                query=query,
-                group=group
-            )
+            log.info("Searching TNVED codes", query=query, group=group)
             
             # Формируем параметры запроса
             params = {"query": query}
@@ -155,10 +321,13 @@ class TNVEDInfoService:
             if response_state in [200, 201]:
                 results = response.get("Result", [])
                 license_info = response.get("License", {})
+                if license_info:
+                    self._license_info = license_info
+                if "Remain" in license_info:
+                    self._license_remain = license_info["Remain"]
                 
-                logger.info(
+                log.info(
                     "TNVED search completed successfully",
-                    request_id=request_id,
                     results_count=len(results),
                     license_remain=license_info.get("Remain", 0)
                 )
@@ -172,9 +341,8 @@ class TNVEDInfoService:
                 }
             
             else:
-                logger.warning(
+                log.warning(
                     "TNVED search returned non-success state",
-                    request_id=request_id,
                     response_state=response_state,
                     error_message=response.get("ErrorMessage")
                 )
@@ -187,9 +355,8 @@ class TNVEDInfoService:
                 }
                 
         except Exception as e:
-            logger.error(
+            log.error(
                 "TNVED search failed",
-                request_id=request_id,
                 error=str(e),
                 exc_info=True
             )
@@ -212,14 +379,29 @@ class TNVEDInfoService:
         """
         
         # Проверяем кэш
-        cache_key = f"tnved_{tnved_code}"
-        if cache_key in self._cache:
-            return self._cache[cache_key]
+        cache_key = self._code_key(tnved_code)
+        tnved_info = self._cache.get(cache_key)
+        if tnved_info is not None:
+            return tnved_info
+        
+        return await self._flights.do(
+            ("info", cache_key),
+            lambda: self._fetch_tnved_info(tnved_code, cache_key, request_id)
+        )
+    
+    async def _fetch_tnved_info(
+        self,
+        tnved_code: str,
+        cache_key: str,
+        request_id: Optional[str] = None
+    ) -> Optional[TNVEDInfo]:
+        """Запрос информации о коде ТН ВЭД в API с сохранением в кэш"""
+        
+        log = logger.bind(request_id=request_id)
         
         try:
-            logger.info(
+            log.info(
                 "Getting TNVED info",
-                request_id=request_id,
                 tnved_code=tnved_code
             )
             
@@ -227,9 +409,8 @@ class TNVEDInfoService:
             search_result = await self.search_tnved_codes(tnved_code, request_id=request_id)
             
             if not search_result["success"]:
-                logger.warning(
+                log.warning(
                     "Failed to get TNVED info",
-                    request_id=request_id,
                     tnved_code=tnved_code,
                     error=search_result.get("error_message")
                 )
@@ -237,12 +418,9 @@ class TNVEDInfoService:
             
             results = search_result.get("results", [])
             
-            # Ищем точное совпадение кода
-            exact_match = None
-            for result in results:
-                if result.get("Code") == tnved_code:
-                    exact_match = result
-                    break
+            # Ищем точное совпадение кода (с точками или без); при повторах - первый результат
+            results_by_code = {self._code_key(result.get("Code") or ""): result for result in reversed(results)}
+            exact_match = results_by_code.get(cache_key)
             
             if not exact_match and results:
                 # Если точного совпадения нет, берём первый результат
@@ -253,34 +431,31 @@ class TNVEDInfoService:
                 tnved_info = TNVEDInfo(
                     code=exact_match.get("Code", tnved_code),
                     description=exact_match.get("Description", ""),
-                    duty_rate=Decimal("5.0"),  # Базовая ставка (можно расширить)
-                    vat_rate=Decimal("12.0"),  # НДС в Казахстане
+                    duty_rate=DEFAULT_DUTY_RATE,
+                    vat_rate=DEFAULT_VAT_RATE,
                     required_documents=self._get_required_documents_by_code(tnved_code),
                     restrictions=[]
                 )
                 
                 # Сохраняем в кэш
-                self._cache[cache_key] = tnved_info
+                self._cache.set(cache_key, tnved_info)
                 
-                logger.info(
+                log.info(
                     "TNVED info retrieved successfully",
-                    request_id=request_id,
                     tnved_code=tnved_code
                 )
                 
                 return tnved_info
             
-            logger.warning(
+            log.warning(
                 "TNVED code not found",
-                request_id=request_id,
                 tnved_code=tnved_code
             )
             return None
             
         except Exception as e:
-            logger.error(
+            log.error(
                 "Failed to get TNVED info",
-                request_id=request_id,
                 tnved_code=tnved_code,
                 error=str(e),
                 exc_info=True
@@ -305,10 +480,24 @@ class TNVEDInfoService:
             Информация о ТН ВЭД коде или None
         """
         
+        return await self._flights.do(
+            ("classify", description.lower().strip(), category),
+            lambda: self._classify_product(description, category, request_id)
+        )
+    
+    async def _classify_product(
+        self,
+        description: str,
+        category: Optional[CargoCategory] = None,
+        request_id: Optional[str] = None
+    ) -> Optional[TNVEDInfo]:
+        """Классификация товара запросом к API"""
+        
+        log = logger.bind(request_id=request_id)
+        
         try:
-            logger.info(
+            log.info(
                 "Classifying product using TNVED API",
-                request_id=request_id,
                 description_length=len(description),
                 category=category
             )
@@ -317,9 +506,8 @@ class TNVEDInfoService:
             search_result = await self.search_tnved_codes(description, request_id=request_id)
             
             if not search_result["success"]:
-                logger.warning(
+                log.warning(
                     "Product classification failed",
-                    request_id=request_id,
                     error=search_result.get("error_message")
                 )
                 return None
@@ -327,79 +515,49 @@ class TNVEDInfoService:
             results = search_result.get("results", [])
             
             if not results:
-                logger.warning(
-                    "No TNVED codes found for product description",
-                    request_id=request_id
-                )
+                log.warning("No TNVED codes found for product description")
                 return None
             
             # Берём результат с наивысшей вероятностью
-            best_match = max(results, key=lambda x: x.get("Probability", 0))
+            probabilities = [result.get("Probability") or 0 for result in results]
+            best_index = max(range(len(results)), key=probabilities.__getitem__)
+            best_match = results[best_index]
             
             # Создаём объект TNVEDInfo
             tnved_info = TNVEDInfo(
                 code=best_match.get("Code", ""),
                 description=best_match.get("Description", description),
-                duty_rate=Decimal("5.0"),  # Базовая ставка
-                vat_rate=Decimal("12.0"),  # НДС в Казахстане
+                duty_rate=DEFAULT_DUTY_RATE,
+                vat_rate=DEFAULT_VAT_RATE,
                 required_documents=self._get_required_documents_by_category(category),
                 restrictions=[]
             )
             
-            logger.info(
+            log.info(
                 "Product classified successfully",
-                request_id=request_id,
                 tnved_code=tnved_info.code,
-                probability=best_match.get("Probability", 0)
+                probability=probabilities[best_index]
             )
             
             return tnved_info
             
         except Exception as e:
-            logger.error(
+            log.error(
                 "Product classification failed",
-                request_id=request_id,
                 error=str(e),
                 exc_info=True
             )
             return None
     
-    def _get_required_documents_by_code(self, tnved_code: str) -> List[str]:
-        """Получение требуемых документов по коду ТН ВЭД"""
-        
-        base_documents = ["Инвойс", "Упаковочный лист", "Сертификат происхождения"]
-        
-        # Простая логика на основе кода
-        if tnved_code.startswith("85"):  # Электроника
-            return base_documents + ["Сертификат соответствия", "Декларация соответствия"]
-        elif tnved_code.startswith("61") or tnved_code.startswith("62"):  # Одежда
-            return base_documents + ["Сертификат качества"]
-        elif tnved_code.startswith("32"):  # Химия
-            return base_documents + ["Сертификат безопасности", "Паспорт безопасности"]
-        elif tnved_code.startswith("09"):  # Продукты питания
-            return base_documents + ["Сертификат качества", "Ветеринарный сертификат"]
-        else:
-            return base_documents
-    
-    def _get_required_documents_by_category(self, category: Optional[CargoCategory]) -> List[str]:
-        """Получение требуемых документов по категории товара"""
-        
-        base_documents = ["Инвойс", "Упаковочный лист", "Сертификат происхождения"]
-        
-        if category == CargoCategory.ELECTRONICS:
-            return base_documents + ["Сертификат соответствия", "Декларация соответствия"]
-        elif category == CargoCategory.CHEMICALS:
-            return base_documents + ["Сертификат безопасности", "Паспорт безопасности"]
-        elif category == CargoCategory.FOOD:
-            return base_documents + ["Сертификат качества", "Ветеринарный сертификат"]
-        else:
-            return base_documents
-    
     async def get_license_info(self) -> Optional[Dict[str, Any]]:
         """Получение информации о лицензии"""
         
+        # Лицензия приходит в каждом ответе поиска - берём из последнего
+        if self._license_info is not None:
+            return self._license_info
+        
         try:
-            # Делаем тестовый запрос для получения информации о лицензии
+            # Поисков ещё не было - делаем тестовый запрос
             search_result = await self.search_tnved_codes("test")
             
             if search_result["success"]:
@@ -417,13 +575,61 @@ class TNVEDInfoService:
         logger.info("TNVED Info cache cleared")
     
     async def health_check(self) -> bool:
-        """Проверка работоспособности API"""
+        """
+        Проверка работоспособности API
+        
+        Вместо поиска (расходует лицензию) отправляется HEAD запрос;
+        результат кэшируется на HEALTH_CHECK_TTL секунд.
+        """
+        now = time.monotonic()
+        if self._health is not None and now - self._health[0] < self.HEALTH_CHECK_TTL:
+            return self._health[1]
         
         try:
-            # Делаем простой запрос для проверки
-            search_result = await self.search_tnved_codes("test")
-            return search_result["success"]
+            response = await get_tnved_client().head(
+                f"{self.base_url}{self.search_endpoint}",
+                headers=self._default_headers,
+                timeout=10
+            )
+            # 2xx - API доступен; 405 - сервер не поддерживает HEAD, но отвечает.
+            # 401/403 (неверные учётные данные, истёкшая лицензия) и прочие
+            # статусы - API для сервиса непригоден
+            healthy = 200 <= response.status_code < 300 or response.status_code == 405
+            if not healthy:
+                logger.error(f"TNVED API health check failed: status {response.status_code}")
             
         except Exception as e:
             logger.error(f"TNVED API health check failed: {e}")
-            return False
+            healthy = False
+        
+        self._health = (now, healthy)
+        return healthy
+
+
+# Глобальный экземпляр сервиса: одна HTTP сессия на всё приложение
+_service: Optional[TNVEDInfoService] = None
+
+
+def get_tnved_info_service() -> Optional[TNVEDInfoService]:
+    """Получение экземпляра сервиса TNVED Info (None, если не настроен)"""
+    global _service
+    
+    if _service is None:
+        if not settings.TNVED_INFO_USERNAME or not settings.TNVED_INFO_PASSWORD:
+            logger.warning("TNVED Info credentials not configured")
+            return None
+        
+        _service = TNVEDInfoService(
+            username=settings.TNVED_INFO_USERNAME,
+            password=settings.TNVED_INFO_PASSWORD
+        )
+    return _service
+
+
+async def close_tnved_info_service() -> None:
+    """Закрытие экземпляра сервиса TNVED Info при остановке приложения"""
+    global _service
+    
+    if _service is not None:
+        await _service.close()
+        _service = None
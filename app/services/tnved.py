@@ -3,20 +3,37 @@
 """
 
 import asyncio
+import re
 from typing import List, Optional, Dict, Any
 from decimal import Decimal
 
-import aiohttp
+import httpx
+import orjson
 import structlog
 
 from app.models.schemas import TNVEDInfo, CargoCategory
+from app.services.tnved_base import DEFAULT_DUTY_RATE, DEFAULT_VAT_RATE, BaseTNVEDService
 
 logger = structlog.get_logger(__name__)
 
 
-class TNVEDService:
+class TNVEDService(BaseTNVEDService):
     """Сервис для работы с ТН ВЭД API"""
     
+    # Ключевые слова категорий и соответствующие коды (проверяются по порядку)
+    CATEGORY_PATTERNS = (
+        # Электроника - лампы светодиодные
+        (re.compile(r"led|light|bulb|lamp|electronic", re.IGNORECASE), "8539.31.000.0"),
+        # Одежда - платья женские
+        (re.compile(r"shirt|dress|clothing|fabric", re.IGNORECASE), "6104.43.000.0"),
+        # Машины и оборудование - портативные вычислительные машины
+        (re.compile(r"machine|equipment|tool", re.IGNORECASE), "8471.30.000.0"),
+        # Химия - краски и лаки
+        (re.compile(r"chemical|paint|varnish", re.IGNORECASE), "3208.10.000.0"),
+        # Продукты питания - чай зеленый
+        (re.compile(r"food|tea|coffee", re.IGNORECASE), "0901.11.000.0"),
+    )
+    
     def __init__(self, tnved_api_key: Optional[str] = None, keden_api_key: Optional[str] = None):
         self.tnved_api_key = tnved_api_key
         self.keden_api_key = keden_api_key
@@ -25,8 +42,10 @@ class TNVEDService:
         self.tnved_base_url = "https://api.tnved.info"
         self.keden_base_url = "https://api.keden.kz"
         
-        # Кэш для часто используемых кодов
-        self._cache = {}
+        # Заголовки авторизации собираются один раз, а не при каждом запросе
+        super().__init__()
+        self._tnved_headers = self._build_headers({"Authorization": f"Bearer {tnved_api_key}"})
+        self._keden_headers = self._build_headers({"X-API-Key": keden_api_key or ""})
     
     async def _make_request(
         self, 
@@ -36,34 +55,20 @@ class TNVEDService:
     ) -> Dict[str, Any]:
         """Выполнение HTTP запроса"""
         
-        default_headers = {
-            "Content-Type": "application/json",
-            "User-Agent": "AI-Logistics-Hub/1.0"
-        }
-        
-        if headers:
-            default_headers.update(headers)
-        
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    url,
-                    headers=default_headers,
-                    timeout=timeout
-                ) as response:
-                    
-                    if response.status == 200:
-                        return await response.json()
-                    elif response.status == 404:
-                        return None
-                    else:
-                        error_text = await response.text()
-                        logger.error(
-                            f"TNVED API error: {response.status} - {error_text}"
-                        )
-                        raise Exception(f"TNVED API error: {response.status}")
-                        
-        except asyncio.TimeoutError:
+            response = await self._send(url, headers=headers, timeout=timeout)
+            
+            if response.status_code == 200:
+                return orjson.loads(response.content)
+            elif response.status_code == 404:
+                return None
+            else:
+                logger.error(
+                    f"TNVED API error: {response.status_code} - {response.text}"
+                )
+                raise Exception(f"TNVED API error: {response.status_code}")
+                
+        except httpx.TimeoutException:
             logger.error("TNVED API request timeout")
             raise Exception("TNVED API request timeout")
         except Exception as e:
@@ -83,6 +88,20 @@ class TNVEDService:
         Пока используем простую логику на основе ключевых слов
         """
         
+        # Одновременные запросы одного описания ждут уже идущий запрос
+        return await self._flights.do(
+            ("classify", description.lower().strip(), category),
+            lambda: self._classify_product(description, category, request_id)
+        )
+    
+    async def _classify_product(
+        self,
+        description: str,
+        category: Optional[CargoCategory],
+        request_id: Optional[str]
+    ) -> TNVEDInfo:
+        """Классификация товара (без объединения запросов)"""
+        
         try:
             logger.info(
                 "Classifying product",
@@ -103,9 +122,9 @@ class TNVEDService:
                 tnved_info = TNVEDInfo(
                     code=tnved_code,
                     description=description,
-                    duty_rate=Decimal("5.0"),  # Базовая ставка
-                    vat_rate=Decimal("12.0"),  # НДС в Казахстане
-                    required_documents=self._get_required_documents(category),
+                    duty_rate=DEFAULT_DUTY_RATE,
+                    vat_rate=DEFAULT_VAT_RATE,
+                    required_documents=self._get_required_documents_by_category(category),
                     restrictions=[]
                 )
             
@@ -126,62 +145,64 @@ class TNVEDService:
             )
             raise
     
-    def _simple_classification(self, description: str, category: Optional[CargoCategory] = None) -> str:
-        """Простая классификация на основе ключевых слов"""
-        
-        description_lower = description.lower()
+    async def classify_products(
+        self,
+        descriptions: List[str],
+        category: Optional[CargoCategory] = None,
+        concurrency: int = 32
+    ) -> List[Optional[TNVEDInfo]]:
+        """
+        Классификация нескольких товаров
         
-        # Электроника
-        if any(word in description_lower for word in ["led", "light", "bulb", "lamp", "electronic"]):
-            return "8539.31.000.0"  # Лампы светодиодные
+        Запросы выполняются параллельно, не более concurrency одновременно.
+        Результаты в порядке descriptions, для неудачных - None.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
         
-        # Одежда
-        if any(word in description_lower for word in ["shirt", "dress", "clothing", "fabric"]):
-            return "6104.43.000.0"  # Платья женские
+        async def classify_one(description: str) -> TNVEDInfo:
+            async with semaphore:
+                return await self.classify_product(description, category)
         
-        # Машины и оборудование
-        if any(word in description_lower for word in ["machine", "equipment", "tool"]):
-            return "8471.30.000.0"  # Портативные вычислительные машины
+        results = await asyncio.gather(
+            *(classify_one(description) for description in descriptions),
+            return_exceptions=True
+        )
         
-        # Химия
-        if any(word in description_lower for word in ["chemical", "paint", "varnish"]):
-            return "3208.10.000.0"  # Краски и лаки
+        return [None if isinstance(result, Exception) else result for result in results]
+    
+    def _simple_classification(self, description: str, category: Optional[CargoCategory] = None) -> str:
+        """Простая классификация на основе ключевых слов"""
         
-        # Продукты питания
-        if any(word in description_lower for word in ["food", "tea", "coffee"]):
-            return "0901.11.000.0"  # Чай зеленый
+        for pattern, tnved_code in self.CATEGORY_PATTERNS:
+            if pattern.search(description):
+                return tnved_code
         
         # По умолчанию - прочие товары
         return "9999.99.000.0"
     
-    def _get_required_documents(self, category: Optional[CargoCategory] = None) -> List[str]:
-        """Получение списка требуемых документов по категории"""
-        
-        base_documents = ["Инвойс", "Упаковочный лист", "Сертификат происхождения"]
-        
-        if category == CargoCategory.ELECTRONICS:
-            return base_documents + ["Сертификат соответствия", "Декларация соответствия"]
-        elif category == CargoCategory.CHEMICALS:
-            return base_documents + ["Сертификат безопасности", "Паспорт безопасности"]
-        elif category == CargoCategory.FOOD:
-            return base_documents + ["Сертификат качества", "Ветеринарный сертификат"]
-        else:
-            return base_documents
-    
     async def get_tnved_info(self, tnved_code: str) -> Optional[TNVEDInfo]:
         """Получение информации о ТН ВЭД коде"""
         
         # Проверяем кэш
-        if tnved_code in self._cache:
-            return self._cache[tnved_code]
+        cache_key = self._code_key(tnved_code)
+        tnved_info = self._cache.get(cache_key)
+        if tnved_info is not None:
+            return tnved_info
+        
+        # Одновременные запросы одного кода ждут уже идущий запрос
+        return await self._flights.do(
+            ("info", cache_key),
+            lambda: self._fetch_tnved_info(tnved_code, cache_key)
+        )
+    
+    async def _fetch_tnved_info(self, tnved_code: str, cache_key: str) -> Optional[TNVEDInfo]:
+        """Загрузка информации о коде из tnved.info или keden.kz"""
         
         try:
             # Пытаемся получить информацию из tnved.info
             if self.tnved_api_key:
                 url = f"{self.tnved_base_url}/api/v1/codes/{tnved_code}"
-                headers = {"Authorization": f"Bearer {self.tnved_api_key}"}
-                
-                response = await self._make_request(url, headers)
+                response = await self._make_request(url, self._tnved_headers)
                 
                 if response:
                     tnved_info = TNVEDInfo(
@@ -194,15 +215,13 @@ class TNVEDService:
                     )
                     
                     # Сохраняем в кэш
-                    self._cache[tnved_code] = tnved_info
+                    self._cache.set(cache_key, tnved_info)
                     return tnved_info
             
             # Если tnved.info недоступен, пробуем keden.kz
             if self.keden_api_key:
                 url = f"{self.keden_base_url}/api/tnved/{tnved_code}"
-                headers = {"X-API-Key": self.keden_api_key}
-                
-                response = await self._make_request(url, headers)
+                response = await self._make_request(url, self._keden_headers)
                 
                 if response:
                     tnved_info = TNVEDInfo(
@@ -215,7 +234,7 @@ class TNVEDService:
                     )
                     
                     # Сохраняем в кэш
-                    self._cache[tnved_code] = tnved_info
+                    self._cache.set(cache_key, tnved_info)
                     return tnved_info
             
             # Если API недоступны, возвращаем None
@@ -234,9 +253,7 @@ class TNVEDService:
             # Пытаемся найти в tnved.info
             if self.tnved_api_key:
                 url = f"{self.tnved_base_url}/api/v1/search?q={query}&limit={limit}"
-                headers = {"Authorization": f"Bearer {self.tnved_api_key}"}
-                
-                response = await self._make_request(url, headers)
+                response = await self._make_request(url, self._tnved_headers)
                 
                 if response and "results" in response:
                     results.extend(response["results"])
@@ -244,9 +261,7 @@ class TNVEDService:
             # Если результатов мало, пробуем keden.kz
             if len(results) < limit and self.keden_api_key:
                 url = f"{self.keden_base_url}/api/search?query={query}&limit={limit - len(results)}"
-                headers = {"X-API-Key": self.keden_api_key}
-                
-                response = await self._make_request(url, headers)
+                response = await self._make_request(url, self._keden_headers)
                 
                 if response and "items" in response:
                     results.extend(response["items"])
@@ -0,0 +1,125 @@
+"""
+Общая основа сервисов ТН ВЭД (tnved.info, keden.kz)
+Один HTTP/2 пул соединений на процесс, кэш кодов и требуемые документы
+"""
+
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from app.core.cache import TTLCache
+from app.core.singleflight import SingleFlight
+from app.models.schemas import CargoCategory
+
+# Ставки по умолчанию: базовая пошлина и НДС в Казахстане (%)
+DEFAULT_DUTY_RATE = Decimal("5.0")
+DEFAULT_VAT_RATE = Decimal("12.0")
+
+# Требуемые документы: базовый набор и дополнительные по категории товара
+_BASE_DOCUMENTS = ("Инвойс", "Упаковочный лист", "Сертификат происхождения")
+_DOCUMENTS_BY_CATEGORY = {
+    CargoCategory.ELECTRONICS: _BASE_DOCUMENTS + ("Сертификат соответствия", "Декларация соответствия"),
+    CargoCategory.CHEMICALS: _BASE_DOCUMENTS + ("Сертификат безопасности", "Паспорт безопасности"),
+    CargoCategory.FOOD: _BASE_DOCUMENTS + ("Сертификат качества", "Ветеринарный сертификат")
+}
+
+# Дополнительные документы по группе ТН ВЭД (первые две цифры кода)
+_DOCUMENTS_BY_CODE_PREFIX = {
+    "85": _BASE_DOCUMENTS + ("Сертификат соответствия", "Декларация соответствия"),  # Электроника
+    "61": _BASE_DOCUMENTS + ("Сертификат качества",),  # Одежда
+    "62": _BASE_DOCUMENTS + ("Сертификат качества",),  # Одежда
+    "32": _BASE_DOCUMENTS + ("Сертификат безопасности", "Паспорт безопасности"),  # Химия
+    "09": _BASE_DOCUMENTS + ("Сертификат качества", "Ветеринарный сертификат")  # Продукты питания
+}
+
+# Общий HTTP/2 клиент всех сервисов ТН ВЭД (создаётся при первом запросе)
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_tnved_client() -> httpx.AsyncClient:
+    """Получение общего HTTP/2 клиента с пулом keep-alive соединений"""
+    global _client
+    
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=True,
+            headers={"User-Agent": "AI-Logistics-Hub/1.0"},
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=128),
+            timeout=30
+        )
+    return _client
+
+
+async def close_tnved_client() -> None:
+    """Закрытие общего HTTP клиента при остановке приложения"""
+    global _client
+    
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+class BaseTNVEDService:
+    """
+    Базовый класс сервисов ТН ВЭД
+    
+    Запросы всех сервисов идут через общий клиент: параллельные запросы
+    к одному хосту мультиплексируются в одном соединении.
+    """
+    
+    def __init__(self, headers: Optional[Dict[str, str]] = None):
+        # Заголовки сервиса (авторизация и т.п.), собираются один раз
+        self._default_headers = self._build_headers(headers)
+        
+        # Кэш для часто используемых кодов (LRU, ставки обновляются раз в час)
+        self._cache = TTLCache(maxsize=4096, ttl=3600)
+        
+        # Выполняющиеся запросы (для объединения одновременных одинаковых вызовов)
+        self._flights = SingleFlight()
+    
+    @staticmethod
+    def _build_headers(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """Заголовки запроса: общие и переданные"""
+        return {"Content-Type": "application/json; charset=utf-8", **(headers or {})}
+    
+    @staticmethod
+    def _code_key(tnved_code: str) -> str:
+        """Ключ кэша кода: "8539.31.000.0" и "8539310000" - одна запись"""
+        return tnved_code.strip().replace(".", "").replace(" ", "")
+    
+    async def initialize(self) -> None:
+        """Инициализация сервиса - создание общего HTTP клиента"""
+        get_tnved_client()
+    
+    async def close(self) -> None:
+        """
+        Освобождение ресурсов сервиса
+        
+        Общий клиент не закрывается: им пользуются другие сервисы,
+        он закрывается close_tnved_client() при остановке приложения.
+        """
+        self._cache.clear()
+    
+    async def _send(
+        self,
+        url: str,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 30
+    ) -> httpx.Response:
+        """GET запрос через общий клиент (headers - полный набор заголовков вместо заголовков сервиса)"""
+        return await get_tnved_client().get(
+            url,
+            params=params,
+            headers=headers or self._default_headers,
+            timeout=timeout
+        )
+    
+    def _get_required_documents_by_code(self, tnved_code: str) -> List[str]:
+        """Получение требуемых документов по коду ТН ВЭД"""
+        return list(_DOCUMENTS_BY_CODE_PREFIX.get(tnved_code[:2], _BASE_DOCUMENTS))
+    
+    def _get_required_documents_by_category(self, category: Optional[CargoCategory]) -> List[str]:
+        """Получение требуемых документов по категории товара"""
+        return list(_DOCUMENTS_BY_CATEGORY.get(category, _BASE_DOCUMENTS))
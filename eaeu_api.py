@@ -3,9 +3,13 @@
 Предоставляет класс EaeuClient для поиска справочников и получения информации о кодах ТН ВЭД.
 """
 
-import aiohttp
+import httpx
 import logging
-from typing import Optional, Dict, Any
+import orjson
+import random
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple, Hashable, Callable, Awaitable
 import asyncio
 
 logger = logging.getLogger(__name__)
@@ -14,32 +18,241 @@ BASE_URL = "https://nsi.eaeunion.org/api/v1"
 REQUEST_TIMEOUT = 30  # секунд
 MAX_RETRIES = 3
 RETRY_DELAY = 1  # секунд
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})  # временные ошибки API
+CACHE_TTL = 3600  # секунд, справочник ТН ВЭД меняется редко
+CACHE_MAXSIZE = 4096
+REDIS_KEY_PREFIX = "eaeu:tnved:"  # ключи общего кэша кодов в Redis
+CB_FAILURE_THRESHOLD = 5  # ошибок подряд до размыкания circuit breaker
+CB_COOLDOWN = 30  # секунд без запросов к API после размыкания
+MAX_CONCURRENT_REQUESTS = 20  # одновременных запросов к API ЕЭК
+
+
+class _SingleFlight:
+    """
+    Объединение одновременных вызовов с одинаковым ключом.
+    
+    Бот запускается отдельно от приложения app, поэтому модуль не
+    импортирует app.core.singleflight и держит свою минимальную копию.
+    """
+    
+    def __init__(self):
+        self._inflight: Dict[Hashable, "asyncio.Future"] = {}
+    
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполнить factory() или дождаться уже идущего запроса с тем же ключом."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # shield: отмена одного из ожидающих не отменяет общий запрос
+        return await asyncio.shield(task)
+    
+    def _forget(self, key: Hashable, task: "asyncio.Future") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
 
 
 class EaeuClient:
     """
     Клиент для работы с API Евразийской Экономической Комиссии.
     
-    Использует асинхронные запросы через aiohttp для получения информации
-    о справочниках и кодах ТН ВЭД.
+    Использует асинхронные запросы через httpx (HTTP/2) для получения информации
+    о справочниках и кодах ТН ВЭД: параллельные запросы идут по одному соединению.
     """
     
-    def __init__(self):
-        """Инициализация клиента."""
+    def __init__(self, redis: Optional[Any] = None):
+        """
+        Инициализация клиента.
+        
+        Args:
+            redis: Клиент redis.asyncio для общего кэша кодов (переживает
+                перезапуск и общий для всех реплик бота); None - только локальный кэш
+        """
         self.base_url = BASE_URL
+        self._redis = redis
         self.tnved_dictionary_id: Optional[str] = None
-        self._session: Optional[aiohttp.ClientSession] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        
+        # Ограничение одновременных запросов: при всплеске сообщений лишние ждут,
+        # а не исчерпывают пул соединений
+        self._sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        
+        # LRU кэши найденных значений: ключ -> (время записи, значение)
+        self._tnved_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._dictionary_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        
+        # Circuit breaker: CLOSED -> OPEN (API недоступен) -> HALF_OPEN (пробный запрос)
+        self._cb_state = "CLOSED"
+        self._cb_failures = 0
+        self._cb_opened_at = 0.0
+        # В HALF_OPEN к API пропускается только один пробный запрос
+        self._cb_probe_in_flight = False
+        self._cb_probe_started_at = 0.0
+        
+        # Идущие запросы (объединение одновременных одинаковых вызовов)
+        self._flights = _SingleFlight()
     
-    async def _get_session(self) -> aiohttp.ClientSession:
-        """Получить или создать сессию aiohttp."""
-        if self._session is None or self._session.closed:
-            self._session = aiohttp.ClientSession()
-        return self._session
+    def _circuit_allows(self) -> bool:
+        """
+        Можно ли обращаться к API (False - circuit breaker разомкнут).
+        
+        После паузы пропускается ровно один пробный запрос; зависшая проба
+        (дольше CB_COOLDOWN без ответа) не блокирует цепь навсегда.
+        """
+        if self._cb_state == "CLOSED":
+            return True
+        now = time.monotonic()
+        if self._cb_state == "OPEN":
+            if now - self._cb_opened_at < CB_COOLDOWN:
+                return False
+            self._cb_state = "HALF_OPEN"
+        if self._cb_probe_in_flight and now - self._cb_probe_started_at < CB_COOLDOWN:
+            return False
+        self._cb_probe_in_flight = True
+        self._cb_probe_started_at = now
+        return True
+    
+    def _record_failure(self) -> None:
+        """Учесть 5xx/таймаут; размыкает цепь после серии ошибок или неудачной пробы."""
+        self._cb_failures += 1
+        self._cb_probe_in_flight = False
+        if self._cb_state == "HALF_OPEN" or self._cb_failures >= CB_FAILURE_THRESHOLD:
+            if self._cb_state != "OPEN":
+                logger.warning(f"API ЕЭК недоступен, запросы приостановлены на {CB_COOLDOWN} с")
+            self._cb_state = "OPEN"
+            self._cb_opened_at = time.monotonic()
+    
+    def _record_success(self) -> None:
+        """API ответил: сбросить счётчик ошибок и замкнуть цепь."""
+        self._cb_failures = 0
+        self._cb_state = "CLOSED"
+        self._cb_probe_in_flight = False
+    
+    def _record_throttled(self) -> None:
+        """429: API доступен, но ограничивает частоту - цепь не меняется, проба освобождается."""
+        self._cb_probe_in_flight = False
+    
+    @staticmethod
+    def _cache_get(cache: OrderedDict, key: str) -> Optional[Any]:
+        """Получить значение из кэша, если оно не устарело."""
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= CACHE_TTL:
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return entry[1]
+    
+    @staticmethod
+    def _cache_put(cache: OrderedDict, key: str, value: Any) -> None:
+        """Сохранить значение в кэш, вытесняя самые давние записи."""
+        cache[key] = (time.monotonic(), value)
+        cache.move_to_end(key)
+        if len(cache) > CACHE_MAXSIZE:
+            cache.popitem(last=False)
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Получить или создать HTTP/2 клиент."""
+        if self._client is None or self._client.is_closed:
+            # Keep-alive дольше idle-таймаута httpx по умолчанию (5 с): соединение
+            # с ЕЭК переживает паузы между сообщениями пользователей.
+            # Accept-Encoding httpx выставляет сам (gzip, deflate и br с пакетом brotli)
+            self._client = httpx.AsyncClient(
+                http2=True,
+                timeout=REQUEST_TIMEOUT,
+                limits=httpx.Limits(
+                    max_keepalive_connections=20,
+                    max_connections=50,
+                    keepalive_expiry=75
+                )
+            )
+        return self._client
     
     async def close(self):
-        """Закрыть сессию aiohttp."""
-        if self._session and not self._session.closed:
-            await self._session.close()
+        """Закрыть HTTP клиент."""
+        if self._client and not self._client.is_closed:
+            await self._client.aclose()
+    
+    async def _redis_get_tnved(self, code: str) -> Optional[Dict[str, Any]]:
+        """Получить информацию о коде из общего кэша Redis."""
+        if self._redis is None:
+            return None
+        try:
+            raw = await self._redis.get(f"{REDIS_KEY_PREFIX}{code}")
+            return orjson.loads(raw) if raw else None
+        except orjson.JSONDecodeError as e:
+            logger.warning(f"Повреждённая запись кэша Redis для кода {code}: {e}")
+            return None
+        except Exception as e:
+            logger.warning(f"Ошибка чтения кэша Redis: {e}")
+            return None
+    
+    async def _redis_put_tnved(self, code: str, result: Dict[str, Any]) -> None:
+        """Сохранить информацию о коде в общий кэш Redis."""
+        if self._redis is None:
+            return
+        try:
+            await self._redis.set(f"{REDIS_KEY_PREFIX}{code}", orjson.dumps(result), ex=CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"Ошибка записи кэша Redis: {e}")
+    
+    async def _request_with_retry(
+        self,
+        url: str,
+        params: Dict[str, str]
+    ) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """
+        GET запрос с повторами при временных ошибках.
+        
+        Повторяются 429, 5xx, сетевые ошибки и таймауты: экспоненциальная
+        задержка со случайным разбросом. Остальные 4xx не повторяются.
+        
+        Returns:
+            Статус ответа и JSON (None, если статус не 200)
+        """
+        client = self._get_client()
+        
+        for attempt in range(MAX_RETRIES):
+            last_attempt = attempt + 1 == MAX_RETRIES
+            try:
+                async with self._sem:
+                    response = await client.get(url, params=params)
+                if response.status_code >= 500:
+                    self._record_failure()
+                elif response.status_code == 429:
+                    self._record_throttled()
+                else:
+                    self._record_success()
+                if response.status_code == 200:
+                    return response.status_code, orjson.loads(response.content)
+                if response.status_code not in RETRY_STATUSES or last_attempt or not self._circuit_allows():
+                    return response.status_code, None
+                logger.warning(f"Временная ошибка API: статус {response.status_code}, попытка {attempt + 1}/{MAX_RETRIES}")
+            except httpx.TransportError as e:
+                self._record_failure()
+                if last_attempt or not self._circuit_allows():
+                    raise
+                logger.warning(f"Ошибка сети: {e!r}, попытка {attempt + 1}/{MAX_RETRIES}")
+            
+            await asyncio.sleep(RETRY_DELAY * (2 ** attempt) * (0.5 + random.random()))
+        
+        # Недостижимо: на последней попытке выше всегда return или raise
+        raise RuntimeError("Retry loop exited without result")
+    
+    @staticmethod
+    def _first_element(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Первый элемент ответа (структура: pagination -> elements -> data).
+        
+        Нужен только он: вызывающий код сразу освобождает остальной ответ,
+        чтобы большие списки elements не держались в памяти до конца запроса.
+        """
+        elements = data.get("pagination", {}).get("elements")
+        if elements:
+            return elements[0]
+        return None
     
     async def find_dictionary_id(self, name_part: str) -> Optional[str]:
         """
@@ -51,8 +264,14 @@ class EaeuClient:
         Returns:
             ID справочника или None, если не найден
         """
+        cached = self._cache_get(self._dictionary_cache, name_part)
+        if cached is not None:
+            return cached
+        if not self._circuit_allows():
+            logger.warning(f"API ЕЭК недоступен, поиск справочника '{name_part}' пропущен")
+            return None
+        
         try:
-            session = await self._get_session()
             url = f"{self.base_url}/dictionaries"
             params = {
                 "conditions[0].conditionType": "like",
@@ -62,27 +281,25 @@ class EaeuClient:
             
             logger.info(f"Поиск справочника: {name_part}")
             
-            timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
-            async with session.get(url, params=params, timeout=timeout) as response:
-                if response.status != 200:
-                    logger.error(f"Ошибка API: статус {response.status}")
-                    return None
-                
-                data = await response.json()
-                
-                # Обработка структуры ответа: pagination -> elements -> data
-                if "pagination" in data and "elements" in data["pagination"]:
-                    elements = data["pagination"]["elements"]
-                    if elements and len(elements) > 0:
-                        # Берем первый найденный справочник
-                        dictionary_id = elements[0].get("id")
-                        logger.info(f"Найден справочник ID: {dictionary_id}")
-                        return dictionary_id
-                
-                logger.warning(f"Справочник '{name_part}' не найден")
+            status, data = await self._request_with_retry(url, params)
+            if status != 200:
+                logger.error(f"Ошибка API: статус {status}")
                 return None
-                
-        except aiohttp.ClientError as e:
+            
+            # Берем первый найденный справочник
+            element = self._first_element(data)
+            del data
+            if element is not None:
+                dictionary_id = element.get("id")
+                logger.info(f"Найден справочник ID: {dictionary_id}")
+                if dictionary_id:
+                    self._cache_put(self._dictionary_cache, name_part, dictionary_id)
+                return dictionary_id
+            
+            logger.warning(f"Справочник '{name_part}' не найден")
+            return None
+            
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка сети при поиске справочника: {e}")
             return None
         except Exception as e:
@@ -92,20 +309,30 @@ class EaeuClient:
     async def _ensure_tnved_dictionary_id(self):
         """Убедиться, что ID справочника ТН ВЭД закеширован."""
         if self.tnved_dictionary_id is None:
-            self.tnved_dictionary_id = await self.find_dictionary_id(
-                "Товарная номенклатура внешнеэкономической деятельности"
+            # Одновременные вызовы (например, предзагрузка нескольких кодов)
+            # ждут один поиск справочника
+            await self._flights.do("dictionary", self._find_tnved_dictionary_id)
+    
+    async def _find_tnved_dictionary_id(self) -> None:
+        """Поиск ID справочника ТН ВЭД по названию и альтернативным названиям."""
+        self.tnved_dictionary_id = await self.find_dictionary_id(
+            "Товарная номенклатура внешнеэкономической деятельности"
+        )
+        if self.tnved_dictionary_id is None:
+            # Попробуем альтернативные варианты поиска - параллельно, но ID
+            # выбирается в порядке приоритета названий, а не по скорости ответа
+            alternative_names = [
+                "ТН ВЭД",
+                "Товарная номенклатура",
+                "ВЭД"
+            ]
+            found_ids = await asyncio.gather(
+                *(self.find_dictionary_id(alt_name) for alt_name in alternative_names)
+            )
+            self.tnved_dictionary_id = next(
+                (dictionary_id for dictionary_id in found_ids if dictionary_id),
+                None
             )
-            if self.tnved_dictionary_id is None:
-                # Попробуем альтернативные варианты поиска
-                alternative_names = [
-                    "ТН ВЭД",
-                    "Товарная номенклатура",
-                    "ВЭД"
-                ]
-                for alt_name in alternative_names:
-                    self.tnved_dictionary_id = await self.find_dictionary_id(alt_name)
-                    if self.tnved_dictionary_id:
-                        break
     
     async def get_tnved_info(self, code: str) -> Optional[Dict[str, Any]]:
         """
@@ -117,6 +344,23 @@ class EaeuClient:
         Returns:
             Словарь с информацией о товаре или None, если не найден
         """
+        cached = self._cache_get(self._tnved_cache, code)
+        if cached is not None:
+            return cached
+        
+        # Одновременные запросы одного кода ждут уже идущий запрос
+        return await self._flights.do(("code", code), lambda: self._fetch_tnved_info(code))
+    
+    async def _fetch_tnved_info(self, code: str) -> Optional[Dict[str, Any]]:
+        """Загрузка информации о коде: общий кэш Redis, затем API ЕЭК."""
+        cached = await self._redis_get_tnved(code)
+        if cached is not None:
+            self._cache_put(self._tnved_cache, code, cached)
+            return cached
+        if not self._circuit_allows():
+            logger.warning(f"API ЕЭК недоступен, поиск кода {code} пропущен")
+            return None
+        
         try:
             # Убеждаемся, что ID справочника закеширован
             await self._ensure_tnved_dictionary_id()
@@ -125,7 +369,6 @@ class EaeuClient:
                 logger.error("Не удалось найти справочник ТН ВЭД")
                 return None
             
-            session = await self._get_session()
             url = f"{self.base_url}/dictionaries/{self.tnved_dictionary_id}/elements"
             params = {
                 "conditions[0].conditionType": "eq",
@@ -135,34 +378,32 @@ class EaeuClient:
             
             logger.info(f"Поиск кода ТН ВЭД: {code}")
             
-            timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
-            async with session.get(url, params=params, timeout=timeout) as response:
-                if response.status != 200:
-                    logger.error(f"Ошибка API: статус {response.status}")
-                    return None
-                
-                data = await response.json()
-                
-                # Обработка структуры ответа: pagination -> elements -> data
-                if "pagination" in data and "elements" in data["pagination"]:
-                    elements = data["pagination"]["elements"]
-                    if elements and len(elements) > 0:
-                        element_data = elements[0].get("data", {})
-                        
-                        # Извлекаем название/описание товара
-                        result = {
-                            "code": code,
-                            "name": element_data.get("Name") or element_data.get("Description") or element_data.get("titleName"),
-                            "full_data": element_data
-                        }
-                        
-                        logger.info(f"Найдена информация для кода {code}")
-                        return result
-                
-                logger.warning(f"Код ТН ВЭД '{code}' не найден")
+            status, data = await self._request_with_retry(url, params)
+            if status != 200:
+                logger.error(f"Ошибка API: статус {status}")
                 return None
+            
+            element = self._first_element(data)
+            del data
+            if element is not None:
+                element_data = element.get("data", {})
                 
-        except aiohttp.ClientError as e:
+                # Извлекаем название/описание товара
+                result = {
+                    "code": code,
+                    "name": element_data.get("Name") or element_data.get("Description") or element_data.get("titleName"),
+                    "full_data": element_data
+                }
+                
+                logger.info(f"Найдена информация для кода {code}")
+                self._cache_put(self._tnved_cache, code, result)
+                await self._redis_put_tnved(code, result)
+                return result
+            
+            logger.warning(f"Код ТН ВЭД '{code}' не найден")
+            return None
+            
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка сети при получении информации о коде: {e}")
             return None
         except Exception as e:
@@ -174,6 +415,6 @@ class EaeuClient:
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        """Закрытие сессии при выходе из context manager."""
+        """Закрытие клиента при выходе из context manager."""
         await self.close()
 
@@ -6,7 +6,18 @@
 import asyncio
 import aiohttp
 import json
-from typing import Dict, Any
+import orjson
+from typing import Dict, Any, Optional
+
+try:
+    import uvloop  # быстрый цикл событий на libuv (нет под Windows)
+except ImportError:
+    uvloop = None
+
+
+def _json_dumps(obj: Any) -> str:
+    """Сериализация тела запроса через orjson (aiohttp ожидает str)"""
+    return orjson.dumps(obj).decode()
 
 
 class TNVEDInfoClient:
@@ -15,6 +26,31 @@ class TNVEDInfoClient:
     def __init__(self, base_url: str = "http://localhost:8000"):
         self.base_url = base_url
         self.api_base = f"{base_url}/api/v1/tnved-info"
+        
+        # Одна сессия на клиента: пул keep-alive соединений для всех запросов
+        self._session: Optional[aiohttp.ClientSession] = None
+    
+    async def __aenter__(self) -> "TNVEDInfoClient":
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Получение HTTP сессии (создаётся при первом запросе)"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=30),
+                json_serialize=_json_dumps
+            )
+        return self._session
+    
+    async def close(self) -> None:
+        """Закрытие HTTP сессии"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
     
     async def search_tnved_codes(self, query: str, group: str = None) -> Dict[str, Any]:
         """Поиск ТН ВЭД кодов"""
@@ -24,18 +60,18 @@ class TNVEDInfoClient:
         if group:
             params["group"] = group
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                return await response.json()
+        session = await self._get_session()
+        async with session.get(url, params=params) as response:
+            return orjson.loads(await response.read())
     
     async def get_tnved_info(self, code: str) -> Dict[str, Any]:
         """Получение информации о коде ТН ВЭД"""
         
         url = f"{self.api_base}/code/{code}"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                return await response.json()
+        session = await self._get_session()
+        async with session.get(url) as response:
+            return orjson.loads(await response.read())
     
     async def classify_product(self, description: str, category: str = None) -> Dict[str, Any]:
         """Классификация товара"""
@@ -45,27 +81,27 @@ class TNVEDInfoClient:
         if category:
             data["category"] = category
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=data) as response:
-                return await response.json()
+        session = await self._get_session()
+        async with session.post(url, json=data) as response:
+            return orjson.loads(await response.read())
     
     async def get_license_info(self) -> Dict[str, Any]:
         """Получение информации о лицензии"""
         
         url = f"{self.api_base}/license"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                return await response.json()
+        session = await self._get_session()
+        async with session.get(url) as response:
+            return orjson.loads(await response.read())
     
     async def health_check(self) -> Dict[str, Any]:
         """Проверка здоровья API"""
         
         url = f"{self.api_base}/health"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                return await response.json()
+        session = await self._get_session()
+        async with session.get(url) as response:
+            return orjson.loads(await response.read())
 
 
 async def main():
@@ -74,83 +110,97 @@ async def main():
     print("🚀 Пример использования API tnved.info")
     print("=" * 50)
     
-    # Создаём клиент
-    client = TNVEDInfoClient()
-    
-    try:
-        # 1. Проверка здоровья API
-        print("\n1️⃣ Проверка здоровья API...")
-        health = await client.health_check()
-        print(f"Статус: {health.get('message', 'Unknown')}")
-        
-        # 2. Информация о лицензии
-        print("\n2️⃣ Информация о лицензии...")
+    # Создаём клиент (сессия закрывается при выходе из блока)
+    async with TNVEDInfoClient() as client:
         try:
-            license_info = await client.get_license_info()
-            print(f"Рабочее место: {license_info.get('work_place', 'N/A')}")
-            print(f"Осталось запросов: {license_info.get('remain', 0)}")
-        except Exception as e:
-            print(f"Ошибка получения лицензии: {e}")
-        
-        # 3. Поиск по описанию товара
-        print("\n3️⃣ Поиск по описанию товара...")
-        search_result = await client.search_tnved_codes("LED light bulbs")
-        
-        if search_result.get("success"):
-            results = search_result.get("results", [])
-            print(f"Найдено результатов: {len(results)}")
+            # Первые три запроса независимы - выполняем их параллельно
+            health, license_info, search_result = await asyncio.gather(
+                client.health_check(),
+                client.get_license_info(),
+                client.search_tnved_codes("LED light bulbs"),
+                return_exceptions=True
+            )
             
-            if results:
-                best_result = results[0]
-                print(f"Лучший результат:")
-                print(f"  Код: {best_result.get('code', 'N/A')}")
-                print(f"  Описание: {best_result.get('description', 'N/A')}")
-                print(f"  Вероятность: {best_result.get('probability', 0):.2f}%")
-        else:
-            print(f"Ошибка поиска: {search_result.get('error_message', 'Unknown error')}")
-        
-        # 4. Получение информации о конкретном коде
-        print("\n4️⃣ Информация о коде ТН ВЭД...")
-        try:
-            tnved_info = await client.get_tnved_info("8539310000")
-            print(f"Код: {tnved_info.get('code', 'N/A')}")
-            print(f"Описание: {tnved_info.get('description', 'N/A')}")
-            print(f"Пошлина: {tnved_info.get('duty_rate', 'N/A')}%")
-            print(f"НДС: {tnved_info.get('vat_rate', 'N/A')}%")
-            print(f"Документы: {', '.join(tnved_info.get('required_documents', []))}")
-        except Exception as e:
-            print(f"Ошибка получения информации: {e}")
-        
-        # 5. Классификация товара
-        print("\n5️⃣ Классификация товара...")
-        classification = await client.classify_product(
-            description="LED light bulbs, 10W, E27 base, white color, energy efficient",
-            category="electronics"
-        )
-        
-        if "code" in classification:
-            print(f"Определён код: {classification.get('code', 'N/A')}")
-            print(f"Описание: {classification.get('description', 'N/A')}")
-            print(f"Документы: {', '.join(classification.get('required_documents', []))}")
-        else:
-            print(f"Ошибка классификации: {classification.get('detail', 'Unknown error')}")
-        
-        # 6. Дополнительные примеры поиска
-        print("\n6️⃣ Дополнительные примеры поиска...")
-        
-        examples = [
-            ("МАЙКИ ТРИКОТАЖНЫЕ", None),
-            ("3921906000", None),  # Код из документации
-            ("ЛАМПЫ СВЕТОДИОДНЫЕ", "8539"),
-            ("ЧАЙ ЗЕЛЕНЫЙ", "0901"),
-            ("КРАСКИ И ЛАКИ", "3208")
-        ]
-        
-        for query, group in examples:
-            print(f"\nПоиск: '{query}'" + (f" (группа: {group})" if group else ""))
+            # 1. Проверка здоровья API
+            print("\n1️⃣ Проверка здоровья API...")
+            if isinstance(health, Exception):
+                raise health
+            print(f"Статус: {health.get('message', 'Unknown')}")
+            
+            # 2. Информация о лицензии
+            print("\n2️⃣ Информация о лицензии...")
+            if isinstance(license_info, Exception):
+                print(f"Ошибка получения лицензии: {license_info}")
+            else:
+                print(f"Рабочее место: {license_info.get('work_place', 'N/A')}")
+                print(f"Осталось запросов: {license_info.get('remain', 0)}")
+            
+            # 3. Поиск по описанию товара
+            print("\n3️⃣ Поиск по описанию товара...")
+            if isinstance(search_result, Exception):
+                raise search_result
+            
+            if search_result.get("success"):
+                results = search_result.get("results", [])
+                print(f"Найдено результатов: {len(results)}")
+                
+                if results:
+                    best_result = results[0]
+                    print(f"Лучший результат:")
+                    print(f"  Код: {best_result.get('code', 'N/A')}")
+                    print(f"  Описание: {best_result.get('description', 'N/A')}")
+                    print(f"  Вероятность: {best_result.get('probability', 0):.2f}%")
+            else:
+                print(f"Ошибка поиска: {search_result.get('error_message', 'Unknown error')}")
+            
+            # 4. Получение информации о конкретном коде
+            print("\n4️⃣ Информация о коде ТН ВЭД...")
             try:
-                result = await client.search_tnved_codes(query, group)
-                if result.get("success"):
+                tnved_info = await client.get_tnved_info("8539310000")
+                print(f"Код: {tnved_info.get('code', 'N/A')}")
+                print(f"Описание: {tnved_info.get('description', 'N/A')}")
+                print(f"Пошлина: {tnved_info.get('duty_rate', 'N/A')}%")
+                print(f"НДС: {tnved_info.get('vat_rate', 'N/A')}%")
+                print(f"Документы: {', '.join(tnved_info.get('required_documents', []))}")
+            except Exception as e:
+                print(f"Ошибка получения информации: {e}")
+            
+            # 5. Классификация товара
+            print("\n5️⃣ Классификация товара...")
+            classification = await client.classify_product(
+                description="LED light bulbs, 10W, E27 base, white color, energy efficient",
+                category="electronics"
+            )
+            
+            if "code" in classification:
+                print(f"Определён код: {classification.get('code', 'N/A')}")
+                print(f"Описание: {classification.get('description', 'N/A')}")
+                print(f"Документы: {', '.join(classification.get('required_documents', []))}")
+            else:
+                print(f"Ошибка классификации: {classification.get('detail', 'Unknown error')}")
+            
+            # 6. Дополнительные примеры поиска
+            print("\n6️⃣ Дополнительные примеры поиска...")
+            
+            examples = [
+                ("МАЙКИ ТРИКОТАЖНЫЕ", None),
+                ("3921906000", None),  # Код из документации
+                ("ЛАМПЫ СВЕТОДИОДНЫЕ", "8539"),
+                ("ЧАЙ ЗЕЛЕНЫЙ", "0901"),
+                ("КРАСКИ И ЛАКИ", "3208")
+            ]
+            
+            # Все поиски отправляются сразу, результаты выводятся в исходном порядке
+            search_results = await asyncio.gather(
+                *(client.search_tnved_codes(query, group) for query, group in examples),
+                return_exceptions=True
+            )
+            
+            for (query, group), result in zip(examples, search_results):
+                print(f"\nПоиск: '{query}'" + (f" (группа: {group})" if group else ""))
+                if isinstance(result, Exception):
+                    print(f"  ❌ Исключение: {result}")
+                elif result.get("success"):
                     results = result.get("results", [])
                     if results:
                         best = results[0]
@@ -159,15 +209,13 @@ async def main():
                         print("  ❌ Результаты не найдены")
                 else:
                     print(f"  ❌ Ошибка: {result.get('error_message', 'Unknown error')}")
-            except Exception as e:
-                print(f"  ❌ Исключение: {e}")
-        
-        print("\n" + "=" * 50)
-        print("✅ Примеры использования завершены!")
-        
-    except Exception as e:
-        print(f"\n❌ Ошибка: {e}")
-        print("Убедитесь, что сервер запущен на http://localhost:8000")
+            
+            print("\n" + "=" * 50)
+            print("✅ Примеры использования завершены!")
+            
+        except Exception as e:
+            print(f"\n❌ Ошибка: {e}")
+            print("Убедитесь, что сервер запущен на http://localhost:8000")
 
 
 if __name__ == "__main__":
@@ -175,4 +223,7 @@ if __name__ == "__main__":
     print("Убедитесь, что сервер запущен: uvicorn app.main:app --reload")
     print()
     
-    asyncio.run(main())
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
@@ -5,13 +5,32 @@
 
 import asyncio
 import aiohttp
+import orjson
 import os
 from dotenv import load_dotenv
-import json
+from pathlib import Path
+
+try:
+    import uvloop  # быстрый цикл событий на libuv (нет под Windows)
+except ImportError:
+    uvloop = None
 
 # Загружаем переменные окружения
 load_dotenv()
 
+
+# Тарифы для заполнения (загружаются из tariffs.json рядом со скриптом)
+TARIFFS_DATA = orjson.loads(Path(__file__).parent.joinpath("tariffs.json").read_bytes())
+
+# Airtable создаёт до 10 записей одним запросом; тела сериализуются один раз
+BATCH_SIZE = 10
+JSON_HEADERS = {"Content-Type": "application/json"}
+_BODIES = [
+    orjson.dumps({"records": TARIFFS_DATA[i:i + BATCH_SIZE]})
+    for i in range(0, len(TARIFFS_DATA), BATCH_SIZE)
+]
+
+
 async def fill_tariffs():
     """Заполнение тарифов в Airtable"""
     
@@ -23,172 +42,56 @@ async def fill_tariffs():
         return
     
     headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
+        "Authorization": f"Bearer {api_key}"
     }
     
-    # Тарифы для заполнения
-    tariffs_data = [
-        # Карго доставка
-        {
-            "fields": {
-                "Route": "Shenzhen-Almaty",
-                "ServiceType": "cargo",
-                "PricePerKg": 2.5,
-                "TransitTime": 12,
-                "Notes": "Карго доставка, контейнер"
-            }
-        },
-        {
-            "fields": {
-                "Route": "Guangzhou-Almaty",
-                "ServiceType": "cargo",
-                "PricePerKg": 2.3,
-                "TransitTime": 14,
-                "Notes": "Карго доставка, контейнер"
-            }
-        },
-        {
-            "fields": {
-                "Route": "Shanghai-Almaty",
-                "ServiceType": "cargo",
-                "PricePerKg": 2.8,
-                "TransitTime": 15,
-                "Notes": "Карго доставка, контейнер"
-            }
-        },
-        {
-            "fields": {
-                "Route": "Shenzhen-Astana",
-                "ServiceType": "cargo",
-                "PricePerKg": 2.7,
-                "TransitTime": 13,
-                "Notes": "Карго доставка, контейнер"
-            }
-        },
-        {
-            "fields": {
-                "Route": "Guangzhou-Astana",
-                "ServiceType": "cargo",
-                "PricePerKg": 2.5,
-                "TransitTime": 15,
-                "Notes": "Карго доставка, контейнер"
-            }
-        },
-        
-        # Белая доставка
-        {
-            "fields": {
-                "Route": "Shenzhen-Almaty",
-                "ServiceType": "white",
-                "PricePerKg": 4.2,
-                "TransitTime": 18,
-                "Notes": "Белая доставка, полное оформление"
-            }
-        },
-        {
-            "fields": {
-                "Route": "Guangzhou-Almaty",
-                "ServiceType": "white",
-                "PricePerKg": 4.0,
-                "TransitTime": 20,
-                "Notes": "Белая доставка, полное оформление"
-            }
-        },
-        {
-            "fields": {
-                "Route": "Shanghai-Almaty",
-                "ServiceType": "white",
-                "PricePerKg": 4.5,
-                "TransitTime": 22,
-                "Notes": "Белая доставка, полное оформление"
-            }
-        },
-        {
-            "fields": {
-                "Route": "Shenzhen-Astana",
-                "ServiceType": "white",
-                "PricePerKg": 4.3,
-                "TransitTime": 19,
-                "Notes": "Белая доставка, полное оформление"
-            }
-        },
-        {
-            "fields": {
-                "Route": "Guangzhou-Astana",
-                "ServiceType": "white",
-                "PricePerKg": 4.1,
-                "TransitTime": 21,
-                "Notes": "Белая доставка, полное оформление"
-            }
-        },
-        
-        # Дополнительные маршруты
-        {
-            "fields": {
-                "Route": "Shenzhen-Shymkent",
-                "ServiceType": "cargo",
-                "PricePerKg": 2.6,
-                "TransitTime": 14,
-                "Notes": "Карго доставка, контейнер"
-            }
-        },
-        {
-            "fields": {
-                "Route": "Shenzhen-Shymkent",
-                "ServiceType": "white",
-                "PricePerKg": 4.4,
-                "TransitTime": 20,
-                "Notes": "Белая доставка, полное оформление"
-            }
-        },
-        {
-            "fields": {
-                "Route": "Guangzhou-Aktobe",
-                "ServiceType": "cargo",
-                "PricePerKg": 2.9,
-                "TransitTime": 16,
-                "Notes": "Карго доставка, контейнер"
-            }
-        },
-        {
-            "fields": {
-                "Route": "Guangzhou-Aktobe",
-                "ServiceType": "white",
-                "PricePerKg": 4.7,
-                "TransitTime": 23,
-                "Notes": "Белая доставка, полное оформление"
-            }
-        }
-    ]
-    
     print("🚀 Заполнение тарифов в Airtable")
     print("=" * 50)
     
     url = f"https://api.airtable.com/v0/{base_id}/Tariffs"
     
-    created_count = 0
+    # Не более 5 одновременных запросов (лимит Airtable - 5 запросов/с на базу)
+    semaphore = asyncio.Semaphore(5)
     
-    for i, tariff in enumerate(tariffs_data, 1):
-        try:
-            print(f"📝 Создаю тариф {i}/{len(tariffs_data)}: {tariff['fields']['Route']} - {tariff['fields']['ServiceType']}")
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=tariff) as response:
+    async def create_batch(session: aiohttp.ClientSession, i: int, body: bytes) -> int:
+        """Создание пачки тарифов, возвращает число созданных записей"""
+        async with semaphore:
+            try:
+                print(f"📝 Создаю пачку тарифов {i}/{len(_BODIES)}")
+                
+                # Тело - готовые байты JSON, тип содержимого указывается явно
+                async with session.post(url, data=body, headers=JSON_HEADERS) as response:
                     if response.status == 200:
-                        result = await response.json()
-                        record_id = result["id"]
-                        print(f"✅ Создан тариф (ID: {record_id})")
-                        created_count += 1
-                    else:
-                        error_text = await response.text()
-                        print(f"❌ Ошибка создания тарифа: {error_text}")
+                        result = orjson.loads(await response.read())
+                        for record in result["records"]:
+                            fields = record.get("fields", {})
+                            print(f"✅ Создан тариф {fields.get('Route')} - {fields.get('ServiceType')} (ID: {record['id']})")
+                        return len(result["records"])
+                    
+                    error_text = await response.text()
+                    print(f"❌ Ошибка создания тарифов: {error_text}")
+                    return 0
                         
-        except Exception as e:
-            print(f"❌ Ошибка создания тарифа: {e}")
+            except Exception as e:
+                print(f"❌ Ошибка создания тарифов: {e}")
+                return 0
+    
+    # Одна сессия на все запросы: keep-alive соединение с api.airtable.com
+    async with aiohttp.ClientSession(
+        headers=headers,
+        timeout=aiohttp.ClientTimeout(total=30),
+        connector=aiohttp.TCPConnector(limit_per_host=10)
+    ) as session:
+        tasks = [create_batch(session, i, body) for i, body in enumerate(_BODIES, 1)]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    
+    created_count = sum(result for result in results if isinstance(result, int))
     
     print("\n" + "=" * 50)
-    print(f"✅ Заполнение завершено! Создано тарифов: {created_count}/{len(tariffs_data)}")
+    print(f"✅ Заполнение завершено! Создано тарифов: {created_count}/{len(TARIFFS_DATA)}")
 
 if __name__ == "__main__":
-    asyncio.run(fill_tariffs())
+    if uvloop is not None:
+        uvloop.run(fill_tariffs())
+    else:
+        asyncio.run(fill_tariffs())
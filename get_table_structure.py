@@ -9,6 +9,11 @@ import os
 from dotenv import load_dotenv
 import json
 
+try:
+    import uvloop  # быстрый цикл событий на libuv (нет под Windows)
+except ImportError:
+    uvloop = None
+
 # Загружаем переменные окружения
 load_dotenv()
 
@@ -52,4 +57,7 @@ async def get_table_structure():
         print(f"❌ Ошибка подключения: {e}")
 
 if __name__ == "__main__":
-    asyncio.run(get_table_structure())
+    if uvloop is not None:
+        uvloop.run(get_table_structure())
+    else:
+        asyncio.run(get_table_structure())
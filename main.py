@@ -9,19 +9,29 @@ OpenAI API отключен для этого бота, чтобы избежа
 import asyncio
 import logging
 import os
+import re
+from collections import OrderedDict
 from typing import Optional
 
+from aiohttp import web
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import RedisStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from dotenv import load_dotenv
+from redis.asyncio import Redis
 
 from eaeu_api import EaeuClient
 from ai_service import suggest_hs_codes
 
+try:
+    import uvloop  # быстрый цикл событий на libuv (нет под Windows)
+except ImportError:
+    uvloop = None
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -40,6 +50,15 @@ logger = logging.getLogger(__name__)
 # Поддержка обоих вариантов для совместимости
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN") or os.getenv("TELEGRAM_BOT_TOKEN", "")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Webhook: Telegram сразу присылает обновления POST запросом.
+# Без WEBHOOK_URL бот работает через polling (для локальной разработки)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
 
 if not TELEGRAM_TOKEN:
     raise ValueError(
@@ -53,11 +72,23 @@ if not GEMINI_API_KEY:
     )
 
 # Инициализация бота и диспетчера
+# Состояния FSM хранятся в Redis: переживают перезапуск и общие для всех реплик
+redis = Redis.from_url(REDIS_URL)
 bot = Bot(token=TELEGRAM_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+dp = Dispatcher(storage=RedisStorage(redis=redis))
+
+# Глобальный экземпляр клиента ЕЭК (кэш кодов тоже в Redis)
+eaeu_client = EaeuClient(redis=redis)
+
+# Проверка формата кода ТН ВЭД: ровно 10 цифр
+_CODE_RE = re.compile(r"\d{10}", re.ASCII).fullmatch
 
-# Глобальный экземпляр клиента ЕЭК
-eaeu_client = EaeuClient()
+# LRU кэш готовых клавиатур: AI часто предлагает одни и те же наборы кодов
+KEYBOARD_CACHE_SIZE = 256
+_keyboard_cache: "OrderedDict[tuple, InlineKeyboardMarkup]" = OrderedDict()
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора до завершения
+_background_tasks: set = set()
 
 
 class ProductStates(StatesGroup):
@@ -75,12 +106,17 @@ def create_codes_keyboard(codes_list: list) -> InlineKeyboardMarkup:
     Returns:
         InlineKeyboardMarkup с кнопками
     """
+    # 31 символ причины однозначно определяет текст кнопки (обрезка после 30)
+    key = tuple((item["code"], item["reason"][:31]) for item in codes_list)
+    keyboard = _keyboard_cache.get(key)
+    if keyboard is not None:
+        _keyboard_cache.move_to_end(key)
+        return keyboard
+    
     buttons = []
-    for item in codes_list:
-        code = item["code"]
-        reason = item["reason"]
+    for code, reason in key:
         # Ограничиваем длину текста кнопки (Telegram ограничение)
-        button_text = f"{code} - {reason[:30]}..." if len(reason) > 30 else f"{code} - {reason}"
+        button_text = f"{code} - {reason[:30]}{'...' if len(reason) > 30 else ''}"
         buttons.append([
             InlineKeyboardButton(
                 text=button_text,
@@ -88,7 +124,19 @@ def create_codes_keyboard(codes_list: list) -> InlineKeyboardMarkup:
             )
         ])
     
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+    _keyboard_cache[key] = keyboard
+    if len(_keyboard_cache) > KEYBOARD_CACHE_SIZE:
+        _keyboard_cache.popitem(last=False)
+    return keyboard
+
+
+async def _prefetch_eec(codes_list: list) -> None:
+    """Заранее загрузить описания предложенных кодов в кэш клиента ЕЭК."""
+    await asyncio.gather(
+        *(eaeu_client.get_tnved_info(item["code"]) for item in codes_list),
+        return_exceptions=True
+    )
 
 
 @dp.message(Command("start"))
@@ -134,6 +182,12 @@ async def process_product_description(message: Message, state: FSMContext):
             )
             return
         
+        # Пока пользователь выбирает код, описания всех вариантов загружаются
+        # из ЕЭК - нажатие кнопки обслуживается из кэша
+        task = asyncio.create_task(_prefetch_eec(codes_list))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        
         # Создаем клавиатуру с кнопками
         keyboard = create_codes_keyboard(codes_list)
         
@@ -163,7 +217,7 @@ async def process_code_check(callback: CallbackQuery, state: FSMContext):
     code = callback.data.replace("check_", "")
     
     # Валидация кода ТН ВЭД
-    if not code or not code.isdigit() or len(code) != 10:
+    if not code or not _CODE_RE(code):
         await callback.answer("❌ Некорректный формат кода ТН ВЭД", show_alert=True)
         logger.warning(f"Некорректный код ТН ВЭД от пользователя: {code}")
         return
@@ -223,15 +277,47 @@ async def on_startup():
     # Инициализируем клиент ЕЭК (находим ID справочника)
     await eaeu_client._ensure_tnved_dictionary_id()
     logger.info("Клиент ЕЭК инициализирован")
+    
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            url=f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        logger.info(f"Webhook установлен: {WEBHOOK_URL}{WEBHOOK_PATH}")
 
 
 async def on_shutdown():
     """Действия при остановке бота."""
     logger.info("Бот останавливается")
+    if WEBHOOK_URL:
+        await bot.delete_webhook()
     await eaeu_client.close()
+    await dp.storage.close()
     await bot.session.close()
 
 
+async def run_webhook():
+    """Приём обновлений через webhook на aiohttp сервере."""
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET or None
+    ).register(app, path=WEBHOOK_PATH)
+    # Запуск и остановка диспетчера (on_startup/on_shutdown) вместе с приложением
+    setup_application(app, dp, bot=bot)
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT).start()
+        logger.info(f"Webhook сервер запущен на {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
 async def main():
     """Основная функция запуска бота."""
     try:
@@ -239,9 +325,12 @@ async def main():
         dp.startup.register(on_startup)
         dp.shutdown.register(on_shutdown)
         
-        # Запуск polling
         logger.info("Запуск бота...")
-        await dp.start_polling(bot)
+        if WEBHOOK_URL:
+            await run_webhook()
+        else:
+            # Polling - запасной режим для разработки
+            await dp.start_polling(bot)
         
     except Exception as e:
         logger.error(f"Критическая ошибка: {e}")
@@ -251,7 +340,10 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if uvloop is not None:
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
 